@@ -1,37 +1,547 @@
 from __future__ import print_function
+import csv
+import sys
+import math
+import time
+import ujson
+import random
+import hashlib
+import multiprocessing
+from collections import OrderedDict
 from Game import GameRunner
 
 
-def sim_competition(compiler, game, gamedb, token, runs, debug=False):
+def code_hash(code):
+    # Byte strings are hashed as they are, so code read from files that aren't ASCII can be hashed too.
+    if isinstance(code, unicode):
+        code = code.encode("utf8")
+    return hashlib.sha1(code).hexdigest()
+
+
+def seeds_hash(seeds):
+    return hashlib.sha1(",".join(map(str, seeds))).hexdigest()
+
+
+def paired_difference(a, b):
+    """Compare two lists of scores that were played on the same seeds.
+
+    Because both lists come from the same games, the luck of each seed cancels out in the per-seed differences,
+    which is why a paired comparison needs far fewer games than comparing the two averages.
+
+    Args:
+        a (list): The first entrant's score on each seed.
+        b (list): The second entrant's score on each seed, in the same order.
+
+    Returns:
+        tuple: The mean of a - b and its standard error. The standard error is None with fewer than 2 games.
+    """
+    assert len(a) == len(b)
+    n = len(a)
+    if n == 0:
+        return 0.0, None
+    diffs = [float(x) - y for x, y in zip(a, b)]
+    mean = sum(diffs) / n
+    if n < 2:
+        return mean, None
+    variance = sum([(d - mean) ** 2 for d in diffs]) / (n - 1)
+    return mean, math.sqrt(variance / n)
+
+
+def normal_quantile(p):
+    """Get the z with a chance p of a standard normal value being below it."""
+    assert 0 < p < 1
+    low, high = -40.0, 40.0
+    for _ in range(100):
+        mid = (low + high) / 2
+        if 0.5 * (1 + math.erf(mid / math.sqrt(2))) < p:
+            low = mid
+        else:
+            high = mid
+    return (low + high) / 2
+
+
+def play_batch(game, prog, seeds):
+    """Play a compiled program on each seed, catching any error it runs into.
+
+    Returns:
+        dict: The score of each game ("scores"), how long it took in seconds ("time"), how many turns were played
+            ("turns") and why it failed ("error"), which is None if it didn't. When it failed the scores are empty.
+    """
+    start = time.time()
+    runner = GameRunner(game, prog)
+    try:
+        scores = runner.run_for_scores(seeds=seeds)
+    except Exception as e:
+        return {"scores": [], "time": time.time() - start, "turns": runner.turn_count,
+                "error": "Runtime error: " + repr(e)}
+    return {"scores": scores, "time": time.time() - start, "turns": runner.turn_count, "error": None}
+
+
+def _sim_batch(task):
+    """Play one batch of games for a student. This is run in the pool's worker processes."""
+    key, compiler, game, code, seeds = task
+    try:
+        prog = compiler.compile(code.split("\n"))
+    except Exception as e:
+        return key, {"scores": [], "time": 0.0, "turns": 0, "error": "Compile error: " + repr(e)}
+    return key, play_batch(game, prog, seeds)
+
+
+def _run_tasks(tasks, processes):
+    if processes == 1:
+        for task in tasks:
+            yield _sim_batch(task)
+        return
+    pool = multiprocessing.Pool(processes)
+    try:
+        for result in pool.imap_unordered(_sim_batch, tasks):
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _results(tasks, processes, coordinator):
+    if coordinator is not None:
+        return coordinator.run_tasks(tasks)
+    return _run_tasks(tasks, processes)
+
+
+def _student_result(code_tk, seeds_tk, scores, wall_time, error):
+    """The result of a student saved with a competition. Students that failed or played no games have no score."""
+    return {"hash": code_tk, "seeds": seeds_tk, "score": GameRunner.avg_score(scores) if scores and not error else None,
+            "scores": scores, "games": len(scores), "time": wall_time, "error": error}
+
+
+def get_comp_seeds(gamedb, token, runs):
+    """Get the seeds every entrant of a competition is played on, adding new ones if there are fewer than runs."""
+    seeds = gamedb.get_comp_seeds(token) or []
+    if len(seeds) < runs:
+        # Seed 0 would make the runner pick a random seed.
+        seeds += [random.randint(1, sys.maxint) for _ in range(runs - len(seeds))]
+        gamedb.set_comp_seeds(token, seeds)
+    return seeds[:runs]
+
+
+def score_bots(compiler, game, codes, seeds, processes=None, batch_size=10):
+    """Play every bot on the same seeds and yield each bot's result as soon as all of its games are done.
+
+    Nothing is saved, so this needs neither a game database nor a server. Like sim_competition, each bot's games are
+    split into batches of batch_size that are played across a pool of processes.
+
+    Args:
+        compiler: The compiler for the bots' code.
+        game (class): The game to play.
+        codes (list): The (key, code) of each bot. The key is only used to tell the results apart.
+        seeds (list): The seeds every bot is played on.
+        processes (int): The number of processes to play games in. Defaults to the number of CPUs. Use 1 to play
+            every game in this process.
+        batch_size (int): The number of games that a process plays at a time.
+
+    Yields:
+        tuple: The key of a bot and its result (see _student_result), which also has the number of turns played
+            ("turns"). Bots are yielded in the order they finish.
+    """
+    assert batch_size > 0
+    seeds = list(seeds)
+    seeds_tk = seeds_hash(seeds)
+    batches = [(start, min(start + batch_size, len(seeds))) for start in range(0, len(seeds), batch_size)]
+    hashes = dict((key, code_hash(code)) for key, code in codes)
+    done = dict((key, {}) for key, _ in codes)
+    assert len(done) == len(codes), "Every bot needs its own key"
+
+    def result_for(key):
+        results = [done[key][batch] for batch in range(len(batches))]
+        errors = [result["error"] for result in results if result["error"]]
+        student = _student_result(hashes[key], seeds_tk, sum([result["scores"] for result in results], []),
+                                  sum([result["time"] for result in results]), errors[0] if errors else None)
+        student["turns"] = sum([result["turns"] for result in results])
+        return student
+
+    for key, _ in codes:
+        if not batches:
+            yield key, result_for(key)
+    tasks = [((key, batch), compiler, game, code, seeds[start:end])
+             for key, code in codes for batch, (start, end) in enumerate(batches)]
+    for (key, batch), result in _run_tasks(tasks, processes):
+        done[key][batch] = result
+        if len(done[key]) == len(batches):
+            yield key, result_for(key)
+
+
+def sim_competition(compiler, game, gamedb, token, runs, debug=False, processes=None, batch_size=10,
+                    coordinator=None, progress=None):
+    """Play every student's code in a competition and save each school's best average score and code.
+
+    Every student is played on the same list of seeds, which is saved with the competition, and the score of each
+    game is kept so that entrants can be compared seed by seed (see rank_competition).
+
+    Each student's runs are split into batches of batch_size games which are played across a pool of processes.
+    Every finished batch is written to the competition's journal, so if the simulation dies it can simply be run
+    again and it will only play the batches that are missing. A school's score is saved once all of its students
+    are done.
+
+    The hash of each student's code and their scores are saved with the competition. When the competition is
+    simulated again only the students whose code changed since then are played.
+
+    Args:
+        compiler: The compiler for the students' code.
+        game (class): The game to play.
+        gamedb (GameDB): The database holding the competition.
+        token (str): The competition's token.
+        runs (int): The number of games to average each student's score over.
+        debug (bool): Print what is going on.
+        processes (int): The number of processes to play games in. Defaults to the number of CPUs. Use 1 to play
+            every game in this process.
+        batch_size (int): The number of games that a process plays at a time.
+        coordinator (Distributed.Coordinator): If given, the games are played by the coordinator's workers instead
+            of a local pool of processes.
+        progress (Progress.CompProgress): If given, it is told about every finished batch.
+    """
     assert gamedb is not None
     assert gamedb.is_comp_token(token)
 
+    seeds = get_comp_seeds(gamedb, token, runs)
+    seeds_tk = seeds_hash(seeds)
+    batches = [(start, min(start + batch_size, runs)) for start in range(0, runs, batch_size)]
+    schools = OrderedDict()
     for school in gamedb.get_schools_in_comp(token):
         if debug:
             print("Got school '" + school + "'")
-        max_score = 0
-        max_code = ""
+        schools[school] = OrderedDict()
         for student in gamedb.get_tokens_for_school(school):
+            code = gamedb.get_code(student)
+            if not code:
+                continue
             if debug:
                 print("Got student '" + student + "'")
+            info = {"code": code, "hash": code_hash(code), "batches": {}, "name": gamedb.get_name(student)}
+            result = gamedb.get_comp_student_result(token, school, student)
+            if result is not None and result["hash"] == info["hash"] and result.get("seeds") == seeds_tk and \
+                    (len(result["scores"]) == runs or result.get("error")):
+                info["result"] = result
+            schools[school][student] = info
+
+    resumed = 0
+    for entry in gamedb.get_comp_journal(token):
+        student = schools.get(entry["school"], {}).get(entry["student"])
+        if student is not None and "result" not in student and entry["hash"] == student["hash"] and \
+                entry.get("seeds") == seeds_tk and entry["batch"] < len(batches) and "result" in entry:
+            student["batches"][entry["batch"]] = entry["result"]
+            resumed += 1
+    if debug and resumed:
+        print("Resuming with", resumed, "batches from the journal")
+
+    def save_student(school, student):
+        info = schools[school][student]
+        results = [info["batches"][batch] for batch in range(len(batches))]
+        errors = [result["error"] for result in results if result["error"]]
+        info["result"] = _student_result(info["hash"], seeds_tk, sum([result["scores"] for result in results], []),
+                                         sum([result["time"] for result in results]), errors[0] if errors else None)
+        gamedb.set_comp_student_result(token, school, student, info["result"])
+
+    tasks = []
+    remaining = {}
+    cached = 0
+    for school, students in schools.items():
+        remaining[school] = 0
+        for student, info in students.items():
+            if "result" in info:
+                cached += 1
+                continue
+            for batch, (start, end) in enumerate(batches):
+                if batch not in info["batches"]:
+                    tasks += [((school, student, batch), compiler, game, info["code"], seeds[start:end])]
+                    remaining[school] += 1
+            if len(info["batches"]) == len(batches):
+                save_student(school, student)
+    if debug and cached:
+        print("Reusing the scores of", cached, "students whose code has not changed")
+
+    def save_school(school):
+        max_score = 0
+        max_code = ""
+        max_scores = []
+        for student, info in schools[school].items():
+            if info["result"]["error"] is None and info["result"]["score"] > max_score:
+                max_score = info["result"]["score"]
+                max_code = info["code"]
+                max_scores = info["result"]["scores"]
+        if debug:
+            print("Saving score for school '" + school + "'...")
+        gamedb.set_comp_avg_score(token, school, max_score)
+        gamedb.set_comp_school_code(token, school, max_code)
+        gamedb.set_comp_school_scores(token, school, max_scores)
+
+    for school in schools:
+        if not remaining[school]:
+            save_school(school)
+
+    if debug:
+        print("Simulating", len(tasks), "batches...")
+    if progress is not None:
+        progress.start(sum([len(task[4]) for task in tasks]))
+    for done, ((school, student, batch), result) in enumerate(_results(tasks, processes, coordinator), 1):
+        info = schools[school][student]
+        info["batches"][batch] = result
+        if progress is not None:
+            progress.update(student, batches[batch][1] - batches[batch][0], result["turns"], result["time"],
+                            name=info["name"])
+        gamedb.add_comp_journal_entry(token, {"school": school, "student": student, "hash": info["hash"],
+                                              "seeds": seeds_tk, "batch": batch, "result": result})
+        if len(info["batches"]) == len(batches):
+            save_student(school, student)
+        if debug:
+            print("Finished batch", batch, "of student '" + student + "'", str(done) + "/" + str(len(tasks)))
+            if result["error"]:
+                print("Student '" + student + "' failed:", result["error"])
+        remaining[school] -= 1
+        if not remaining[school]:
+            save_school(school)
+
+    gamedb.clear_comp_journal(token)
+    if progress is not None:
+        progress.finish()
+    if debug:
+        print("All done :)")
+
+
+def race_competition(compiler, game, gamedb, token, runs, debug=False, processes=None, coordinator=None,
+                     round_size=10, min_games=10, delta=0.05, progress=None):
+    """Find each school's best code in a competition without playing every student all of the runs.
+
+    Every student still in the race plays round_size more games of the competition's seeds each round. Once a
+    student has played min_games, they are dropped when the school's current leader is ahead of them by more than z
+    standard errors (compared seed by seed, see paired_difference). The students that are left keep playing until
+    runs games, so each school's saved score is the average over the same seeds as sim_competition uses.
+
+    Since the leader is picked again and every student is tested again each round, z is not a plain single test's
+    z. It is Bonferroni corrected across every round that can drop students and every rival of the school's best
+    student, so the chance of dropping a school's truly best student is at most delta. This relies on each paired
+    difference being close to normal, which holds once min_games is not too small.
+
+    Students' scores are saved after every round, so a race that dies or a later race or sim_competition on the
+    same competition reuses every game that was already played for unchanged code.
+
+    Args:
+        compiler: The compiler for the students' code.
+        game (class): The game to play.
+        gamedb (GameDB): The database holding the competition.
+        token (str): The competition's token.
+        runs (int): The number of games to average each school's best code over.
+        debug (bool): Print what is going on.
+        processes (int): The number of processes to play games in. Defaults to the number of CPUs.
+        coordinator (Distributed.Coordinator): If given, the games are played by the coordinator's workers.
+        round_size (int): The number of games each student still in the race plays per round.
+        min_games (int): The number of games a student plays before they can be dropped.
+        delta (float): The highest allowed chance of dropping a school's best student.
+        progress (Progress.CompProgress): If given, it is told about every finished batch. Its total is the number of
+            games left if no more students were dropped.
+
+    Returns:
+        dict: How many games were played ("games"), reused from earlier runs ("reused"), would have been played
+            without racing ("flat_games"), were skipped by dropping students ("saved") and were not played because
+            a student's bot failed ("failed").
+    """
+    assert 0 < delta < 1
+    assert gamedb is not None
+    assert gamedb.is_comp_token(token)
+
+    seeds = get_comp_seeds(gamedb, token, runs)
+    seeds_tk = seeds_hash(seeds)
+    schools = OrderedDict()
+    reused = 0
+    for school in gamedb.get_schools_in_comp(token):
+        schools[school] = OrderedDict()
+        for student in gamedb.get_tokens_for_school(school):
             code = gamedb.get_code(student)
             if not code:
                 continue
-            if debug:
-                print("Compiling code...")
-            prog = compiler.compile(code.split("\n"))
-            if debug:
-                print("Setting up game runner...")
-            runner = GameRunner(game, prog)
-            if debug:
-                print("Simulating...")
-            score = runner.run_for_avg_score(times=runs)
+            info = {"code": code, "hash": code_hash(code), "scores": [], "time": 0.0, "error": None,
+                    "name": gamedb.get_name(student)}
+            result = gamedb.get_comp_student_result(token, school, student)
+            if result is not None and result["hash"] == info["hash"] and result.get("seeds") == seeds_tk:
+                info["scores"] = result["scores"][:runs]
+                info["time"] = result.get("time", 0.0)
+                info["error"] = result.get("error")
+                reused += len(info["scores"])
+            schools[school][student] = info
+    contenders = dict((school, [student for student in students if students[student]["error"] is None])
+                      for school, students in schools.items())
+
+    def save_student(school, student):
+        info = schools[school][student]
+        gamedb.set_comp_student_result(token, school, student, _student_result(info["hash"], seeds_tk, info["scores"],
+                                                                               info["time"], info["error"]))
+
+    def games_left():
+        return sum([runs - len(schools[school][student]["scores"])
+                    for school in schools for student in contenders[school]])
+
+    # Every round that ends at or after min_games can drop students.
+    targets = [min(target, runs) for target in range(round_size, runs + round_size, round_size)]
+    looks = len([target for target in targets if target >= min_games])
+
+    played = 0
+    target = 0
+    if progress is not None:
+        progress.start(games_left())
+    while target < runs:
+        target = min(target + round_size, runs)
+        tasks = []
+        for school in schools:
+            for student in contenders[school]:
+                info = schools[school][student]
+                if len(info["scores"]) < target:
+                    tasks += [((school, student), compiler, game, info["code"], seeds[len(info["scores"]):target])]
+        for (school, student), result in _results(tasks, processes, coordinator):
+            info = schools[school][student]
+            if progress is not None:
+                progress.update(student, target - len(info["scores"]), result["turns"], result["time"],
+                                name=info["name"])
+            info["time"] += result["time"]
+            if result["error"]:
+                info["error"] = result["error"]
+                contenders[school].remove(student)
+                if debug:
+                    print("Student '" + student + "' failed:", result["error"])
+            info["scores"] += result["scores"]
+            played += len(result["scores"])
+            save_student(school, student)
+
+        if target < min_games:
+            continue
+        for school in schools:
+            if len(contenders[school]) < 2:
+                continue
+            students = schools[school]
+            rivals = max(len(students) - 1, 1)
+            z = normal_quantile(1 - delta / (looks * rivals))
+            leader = max(contenders[school], key=lambda student: sum(students[student]["scores"][:target]))
+            leader_scores = students[leader]["scores"][:target]
+            still_in = []
+            for student in contenders[school]:
+                lead, stderr = paired_difference(leader_scores, students[student]["scores"][:target])
+                if stderr is not None and lead > z * stderr:
+                    if debug:
+                        print("Dropped student '" + student + "' after", target, "games")
+                else:
+                    still_in += [student]
+            contenders[school] = still_in
+        if progress is not None:
+            progress.set_total(progress.done + games_left())
+        if debug:
+            print("Played", target, "of", runs, "games,", sum(map(len, contenders.values())), "students left")
+
+    for school in schools:
+        max_score = 0
+        max_code = ""
+        max_scores = []
+        for student in contenders[school]:
+            info = schools[school][student]
+            score = GameRunner.avg_score(info["scores"])
             if score > max_score:
                 max_score = score
-                max_code = code
-        if debug:
-            print("Saving score...")
+                max_code = info["code"]
+                max_scores = info["scores"]
         gamedb.set_comp_avg_score(token, school, max_score)
         gamedb.set_comp_school_code(token, school, max_code)
+        gamedb.set_comp_school_scores(token, school, max_scores)
+
+    flat_games = runs * sum(map(len, schools.values()))
+    failed = sum([runs - len(info["scores"]) for students in schools.values() for info in students.values()
+                  if info["error"]])
+    report = {"games": played, "reused": reused, "flat_games": flat_games, "failed": failed,
+              "saved": flat_games - played - reused - failed}
+    if progress is not None:
+        progress.finish()
     if debug:
+        print("Played", played, "games instead of", flat_games, "saving", report["saved"])
+        if failed:
+            print(failed, "games were not played because bots failed")
         print("All done :)")
+    return report
+
+
+def rank_competition(gamedb, token, z=1.96):
+    """Rank the schools in a simulated competition using paired comparisons on the competition's seeds.
+
+    Args:
+        gamedb (GameDB): The database holding the competition.
+        token (str): The competition's token.
+        z (float): How many standard errors apart two schools need to be for their order to count as confident.
+            1.96 is about 95% confidence.
+
+    Returns:
+        list: A dict for each school from best to worst with its token, score and number of games, plus how far
+            ahead it is of the next school ("lead"), the standard error of that lead ("stderr") and whether the lead
+            is bigger than z standard errors ("confident").
+    """
+    ranking = []
+    for school in gamedb.get_schools_in_comp(token):
+        score = gamedb.get_comp_avg_score(token, school)
+        if score is None:
+            continue
+        ranking += [{"school": school, "score": score, "scores": gamedb.get_comp_school_scores(token, school) or []}]
+    ranking.sort(key=lambda entry: entry["score"], reverse=True)
+
+    for entry, next_entry in zip(ranking, ranking[1:] + [None]):
+        entry["games"] = len(entry["scores"])
+        entry["lead"] = entry["stderr"] = None
+        entry["confident"] = False
+        if next_entry is not None and next_entry["scores"] and len(entry["scores"]) == len(next_entry["scores"]):
+            entry["lead"], entry["stderr"] = paired_difference(entry["scores"], next_entry["scores"])
+            if entry["stderr"] is not None:
+                entry["confident"] = entry["lead"] > z * entry["stderr"]
+    for entry in ranking:
+        del entry["scores"]
+    return ranking
+
+
+REPORT_FIELDS = ["school", "school_name", "student", "student_name", "score", "games", "time", "error"]
+
+
+def iter_comp_results(gamedb, token, names=True):
+    """Go through the saved result of every student in a competition, reading one at a time.
+
+    Args:
+        gamedb (GameDB): The database holding the competition.
+        token (str): The competition's token.
+        names (bool): Look up the school and student names too.
+
+    Yields:
+        dict: The fields in REPORT_FIELDS for a student plus their score on each of the competition's seeds.
+    """
+    for school in gamedb.get_schools_in_comp(token):
+        school_name = gamedb.get_name(school) if names else None
+        for student in gamedb.get_comp_students(token, school):
+            result = gamedb.get_comp_student_result(token, school, student)
+            if result is None:
+                continue
+            yield {"school": school, "school_name": school_name, "student": student,
+                   "student_name": gamedb.get_name(student) if names else None,
+                   "score": result.get("score"), "games": result.get("games", len(result.get("scores", []))),
+                   "time": result.get("time"), "error": result.get("error"), "scores": result.get("scores", [])}
+
+
+def write_comp_report(gamedb, token, fp, fmt="csv", names=True):
+    """Write the result of every student in a competition to a file as it is read.
+
+    Args:
+        gamedb (GameDB): The database holding the competition.
+        token (str): The competition's token.
+        fp (file): The file to write to.
+        fmt (str): "csv" for one row per student with the REPORT_FIELDS columns or "json" for one JSON object per
+            line per student which also has their score on every seed.
+        names (bool): Look up the school and student names too.
+    """
+    assert fmt in ("csv", "json")
+    if fmt == "csv":
+        writer = csv.DictWriter(fp, REPORT_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+    for result in iter_comp_results(gamedb, token, names=names):
+        if fmt == "csv":
+            writer.writerow(dict((k, v.encode("utf8") if isinstance(v, unicode) else v) for k, v in result.items()))
+        else:
+            fp.write(ujson.dumps(result) + "\n")
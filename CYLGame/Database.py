@@ -2,11 +2,34 @@ import io
 import os
 import ujson
 import random
+import shutil
+import hashlib
+import tarfile
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+class _HashingReader(object):
+    """File wrapper that hashes everything read through it."""
+    def __init__(self, fp):
+        self.fp = fp
+        self.sha1 = hashlib.sha1()
+
+    def read(self, size=-1):
+        data = self.fp.read(size)
+        self.sha1.update(data)
+        return data
+
+    def hexdigest(self):
+        return self.sha1.hexdigest()
 
 
 # TODO(derpferd): Use the move function to prevent RACE on files
 class GameDB(object):
     TOKEN_LEN = 8
+    SNAPSHOT_DIRS = ["data", "schools", "competitions"]
+    SNAPSHOT_MANIFEST = "MANIFEST.json"
 
     def __init__(self, game_dir):
         self.game_dir = game_dir
@@ -88,6 +111,9 @@ class GameDB(object):
             return os.path.join(self.competitions_dir, token, *fns)
         return None
 
+    def _get_path_for_token(self, token, fns=[]):
+        return self.__get_dir_for_token(token, fns)
+
     def __get_cur_code_for_token(self, token):
         pass
 
@@ -218,6 +244,110 @@ class GameDB(object):
         else:
             return None
 
+    def set_comp_progress(self, ctoken, progress):
+        assert self.is_comp_token(ctoken)
+        # Write then move so that the server never reads half a file.
+        progress_fn = self.__get_dir_for_token(ctoken, "progress")
+        with open(progress_fn + ".tmp", "w") as fp:
+            ujson.dump(progress, fp)
+        os.rename(progress_fn + ".tmp", progress_fn)
+
+    def get_comp_progress(self, ctoken):
+        if os.path.exists(self.__get_dir_for_token(ctoken, "progress")):
+            with open(self.__get_dir_for_token(ctoken, "progress"), "r") as fp:
+                return ujson.load(fp)
+        else:
+            return None
+
+    def set_comp_seeds(self, ctoken, seeds):
+        assert self.is_comp_token(ctoken)
+        with open(self.__get_dir_for_token(ctoken, "seeds"), "w") as fp:
+            ujson.dump(seeds, fp)
+
+    def get_comp_seeds(self, ctoken):
+        if os.path.exists(self.__get_dir_for_token(ctoken, "seeds")):
+            with open(self.__get_dir_for_token(ctoken, "seeds"), "r") as fp:
+                return ujson.load(fp)
+        else:
+            return None
+
+    def set_comp_school_scores(self, ctoken, stoken, scores):
+        """Save the score of each game, in competition seed order, of a school's best code."""
+        school_dir = self.__get_dir_for_token(ctoken, ["schools", stoken])
+        assert school_dir is not None
+        with open(os.path.join(school_dir, "scores"), "w") as fp:
+            ujson.dump(scores, fp)
+
+    def get_comp_school_scores(self, ctoken, stoken):
+        school_dir = self.__get_dir_for_token(ctoken, ["schools", stoken])
+        if os.path.exists(os.path.join(school_dir, "scores")):
+            with open(os.path.join(school_dir, "scores"), "r") as fp:
+                return ujson.load(fp)
+        else:
+            return None
+
+    def set_comp_student_result(self, ctoken, stoken, utoken, result):
+        """Save the result of simulating a student's code in a competition.
+
+        Args:
+            ctoken (str): The competition's token.
+            stoken (str): The student's school's token.
+            utoken (str): The student's token.
+            result (dict): Anything that can be dumped to JSON.
+        """
+        students_dir = self.__get_dir_for_token(ctoken, ["schools", stoken, "students"])
+        assert students_dir is not None
+        if not os.path.exists(students_dir):
+            os.mkdir(students_dir)
+        with open(os.path.join(students_dir, utoken), "w") as fp:
+            ujson.dump(result, fp)
+
+    def get_comp_students(self, ctoken, stoken):
+        """Get the tokens of the students of a school that have a saved result in a competition."""
+        students_dir = self.__get_dir_for_token(ctoken, ["schools", stoken, "students"])
+        if students_dir is not None and os.path.exists(students_dir):
+            return os.listdir(students_dir)
+        return []
+
+    def get_comp_student_result(self, ctoken, stoken, utoken):
+        result_fn = self.__get_dir_for_token(ctoken, ["schools", stoken, "students", utoken])
+        if os.path.exists(result_fn):
+            with open(result_fn, "r") as fp:
+                try:
+                    return ujson.load(fp)
+                except ValueError:
+                    return None
+        else:
+            return None
+
+    def add_comp_journal_entry(self, ctoken, entry):
+        """Append an entry to a competition's journal.
+
+        Args:
+            ctoken (str): The competition's token.
+            entry (dict): Anything that can be dumped to JSON.
+        """
+        assert self.is_comp_token(ctoken)
+        with open(self.__get_dir_for_token(ctoken, "journal"), "a") as fp:
+            fp.write(ujson.dumps(entry) + "\n")
+
+    def get_comp_journal(self, ctoken):
+        """Get all of the entries in a competition's journal in the order they were added."""
+        entries = []
+        if os.path.exists(self.__get_dir_for_token(ctoken, "journal")):
+            with open(self.__get_dir_for_token(ctoken, "journal"), "r") as fp:
+                for line in fp:
+                    try:
+                        entries += [ujson.loads(line)]
+                    except ValueError:
+                        # A line is cut off if we crashed while writing it.
+                        continue
+        return entries
+
+    def clear_comp_journal(self, ctoken):
+        if os.path.exists(self.__get_dir_for_token(ctoken, "journal")):
+            os.remove(self.__get_dir_for_token(ctoken, "journal"))
+
     def save_code(self, token, code):
         """Save a user's code under their token.
 
@@ -296,3 +426,242 @@ class GameDB(object):
 
     def get_school_tokens(self):
         return self.__get_school_tokens()
+
+    def export_snapshot(self, path):
+        """Stream the whole database into a single gzipped tar archive.
+
+        The archive ends with a manifest holding the sha1 of every file so that the snapshot can be checked with
+        verify_snapshot before it is imported.
+
+        Args:
+            path (str): The file to write the snapshot to.
+        """
+        manifest = {"dirs": [], "files": {}}
+        with tarfile.open(path, "w|gz") as tar:
+            for top in self.SNAPSHOT_DIRS:
+                for root, dirs, files in os.walk(os.path.join(self.game_dir, top)):
+                    dirs.sort()
+                    rel_root = os.path.relpath(root, self.game_dir)
+                    tar.addfile(tar.gettarinfo(root, rel_root))
+                    manifest["dirs"] += [rel_root]
+                    for fn in sorted(files):
+                        info = tar.gettarinfo(os.path.join(root, fn), os.path.join(rel_root, fn))
+                        with open(os.path.join(root, fn), "rb") as fp:
+                            reader = _HashingReader(fp)
+                            tar.addfile(info, reader)
+                        manifest["files"][info.name] = reader.hexdigest()
+
+            data = ujson.dumps(manifest)
+            info = tarfile.TarInfo(self.SNAPSHOT_MANIFEST)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+    @staticmethod
+    def __read_snapshot(path, dest=None):
+        """Stream through a snapshot checking it against its manifest. Optionally extract it into dest.
+
+        Raises:
+            ValueError: If the snapshot is damaged or does not match its manifest.
+        """
+        dirs = set()
+        files = {}
+        manifest = None
+        with tarfile.open(path, "r|gz") as tar:
+            for member in tar:
+                name = os.path.normpath(member.name)
+                if manifest is not None:
+                    raise ValueError("Snapshot has data after its manifest")
+                if name == GameDB.SNAPSHOT_MANIFEST:
+                    manifest = ujson.loads(tar.extractfile(member).read())
+                    continue
+                if os.path.isabs(name) or name.split(os.sep)[0] not in GameDB.SNAPSHOT_DIRS:
+                    raise ValueError("Snapshot contains an invalid path: " + member.name)
+                if member.isdir():
+                    dirs.add(name)
+                    if dest is not None:
+                        os.mkdir(os.path.join(dest, name))
+                elif member.isfile():
+                    reader = _HashingReader(tar.extractfile(member))
+                    if dest is not None:
+                        with open(os.path.join(dest, name), "wb") as fp:
+                            shutil.copyfileobj(reader, fp)
+                    else:
+                        while reader.read(io.DEFAULT_BUFFER_SIZE):
+                            pass
+                    files[name] = reader.hexdigest()
+                else:
+                    raise ValueError("Snapshot contains something that is not a file or directory: " + member.name)
+
+        if manifest is None:
+            raise ValueError("Snapshot is missing its manifest")
+        if dirs != set(manifest["dirs"]) or files != manifest["files"]:
+            raise ValueError("Snapshot does not match its manifest")
+        for top in GameDB.SNAPSHOT_DIRS:
+            if top not in dirs:
+                raise ValueError("Snapshot is missing the " + top + " directory")
+        # Every user token of a school must have a data dir.
+        for name in files:
+            parts = name.split(os.sep)
+            if len(parts) == 4 and parts[0] == "schools" and parts[2] == "tokens":
+                if os.path.join("data", parts[3]) not in dirs:
+                    raise ValueError("Snapshot is missing the data for token " + parts[3])
+        return len(dirs), len(files)
+
+    @staticmethod
+    def verify_snapshot(path):
+        """Check a snapshot's consistency without importing it.
+
+        Args:
+            path (str): The snapshot file.
+
+        Returns:
+            tuple: The number of directories and files in the snapshot.
+
+        Raises:
+            ValueError: If the snapshot is damaged or inconsistent.
+        """
+        return GameDB.__read_snapshot(path)
+
+    def import_snapshot(self, path):
+        """Replace the database with the contents of a snapshot.
+
+        The snapshot is extracted and checked next to the current database first, so nothing is changed if the
+        snapshot turns out to be damaged. The directories are then swapped one at a time. If a swap fails the ones
+        already swapped are put back, so the database is never left half old and half new.
+
+        Args:
+            path (str): The snapshot file.
+
+        Raises:
+            ValueError: If the snapshot is damaged or inconsistent.
+        """
+        staging_dir = tempfile.mkdtemp(prefix=".import_", dir=self.game_dir)
+        try:
+            self.__read_snapshot(path, staging_dir)
+        except:
+            shutil.rmtree(staging_dir)
+            raise
+
+        moved_old = []
+        moved_new = []
+        try:
+            for top in self.SNAPSHOT_DIRS:
+                os.rename(os.path.join(self.game_dir, top), os.path.join(staging_dir, "old_" + top))
+                moved_old += [top]
+                os.rename(os.path.join(staging_dir, top), os.path.join(self.game_dir, top))
+                moved_new += [top]
+        except:
+            # If putting the old directories back fails too, they are left in the staging dir to be fixed by hand.
+            for top in reversed(moved_old):
+                if top in moved_new:
+                    os.rename(os.path.join(self.game_dir, top), os.path.join(staging_dir, top))
+                os.rename(os.path.join(staging_dir, "old_" + top), os.path.join(self.game_dir, top))
+            shutil.rmtree(staging_dir)
+            raise
+        shutil.rmtree(staging_dir)
+
+
+class CachedGameDB(GameDB):
+    """A GameDB that keeps recently read names, code and scores in a bounded LRU cache.
+
+    Writes made through this object drop the cached value straight away. Writes made by other processes are
+    caught by checking the file's inode, size, mtime and ctime before every cache hit, which only costs a stat call.
+    The one write by another process that can be missed is one that keeps the file's inode and size and lands within
+    the filesystem's timestamp granularity of the previous one (e.g. a score going from "12.5" to "13.5" on a
+    filesystem with one second timestamps).
+
+    The cache is shared by every thread using this object (like a threaded Flask server) and is guarded by a lock.
+    """
+    def __init__(self, game_dir, cache_size=4096):
+        super(CachedGameDB, self).__init__(game_dir)
+        self.cache_size = cache_size
+        self.__cache = OrderedDict()
+        self.__lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def __stamp(path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_size, stat.st_mtime, stat.st_ctime
+
+    def __cached(self, key, path_func, read_func):
+        """Get a value from the cache, reading it with read_func if it is missing or the file changed."""
+        with self.__lock:
+            entry = self.__cache.pop(key, None)
+            if entry is not None and self.__stamp(entry[0]) == entry[1]:
+                self.hits += 1
+                self.__cache[key] = entry
+                return entry[2]
+            self.misses += 1
+        path = path_func()
+        if path is None:
+            # Not a valid token (yet) so there is no file to watch.
+            return read_func()
+        # The stamp is taken before reading, so a write that lands in between makes the next hit read it again.
+        stamp = self.__stamp(path)
+        value = read_func()
+        with self.__lock:
+            self.__cache[key] = (path, stamp, value)
+            while len(self.__cache) > self.cache_size:
+                self.__cache.popitem(last=False)
+        return value
+
+    def __invalidate(self, key):
+        with self.__lock:
+            self.__cache.pop(key, None)
+
+    def clear_cache(self):
+        with self.__lock:
+            self.__cache.clear()
+
+    def cache_stats(self):
+        """Get how well the cache is doing.
+
+        Returns:
+            dict: The number of hits, misses, cached entries and the hit ratio.
+        """
+        with self.__lock:
+            hits, misses, size = self.hits, self.misses, len(self.__cache)
+        total = hits + misses
+        return {"hits": hits, "misses": misses, "size": size, "hit_ratio": float(hits) / total if total else 0.0}
+
+    def get_name(self, token):
+        return self.__cached(("name", token), lambda: self._get_path_for_token(token, "name"),
+                             lambda: super(CachedGameDB, self).get_name(token))
+
+    def get_code(self, token):
+        return self.__cached(("code", token), lambda: self._get_path_for_token(token, "code.lp"),
+                             lambda: super(CachedGameDB, self).get_code(token))
+
+    def get_avg_score(self, token):
+        return self.__cached(("avg_score", token), lambda: self._get_path_for_token(token, "avg_score"),
+                             lambda: super(CachedGameDB, self).get_avg_score(token))
+
+    def get_comp_avg_score(self, ctoken, stoken):
+        return self.__cached(("comp_avg_score", ctoken, stoken),
+                             lambda: self._get_path_for_token(ctoken, ["schools", stoken, "avg_score"]),
+                             lambda: super(CachedGameDB, self).get_comp_avg_score(ctoken, stoken))
+
+    def save_code(self, token, code):
+        self.__invalidate(("code", token))
+        super(CachedGameDB, self).save_code(token, code)
+
+    def save_name(self, token, name):
+        self.__invalidate(("name", token))
+        super(CachedGameDB, self).save_name(token, name)
+
+    def save_avg_score(self, token, score):
+        self.__invalidate(("avg_score", token))
+        super(CachedGameDB, self).save_avg_score(token, score)
+
+    def set_comp_avg_score(self, ctoken, stoken, score):
+        self.__invalidate(("comp_avg_score", ctoken, stoken))
+        super(CachedGameDB, self).set_comp_avg_score(ctoken, stoken, score)
+
+    def import_snapshot(self, path):
+        super(CachedGameDB, self).import_snapshot(path)
+        self.clear_cache()
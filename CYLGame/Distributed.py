@@ -0,0 +1,236 @@
+from __future__ import print_function
+import os
+import time
+import binascii
+import Queue
+import socket
+import itertools
+import threading
+import multiprocessing
+from collections import deque
+from multiprocessing.managers import BaseManager
+from Comp import code_hash
+from Comp import play_batch
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 5050
+DONE = "done"
+
+
+def new_authkey():
+    """Make a random authkey for a coordinator."""
+    return binascii.hexlify(os.urandom(16))
+
+
+class _TaskBoard(object):
+    """The coordinator's list of tasks. Workers use it through a manager proxy so every method must be thread safe."""
+    def __init__(self, task_timeout):
+        self.task_timeout = task_timeout
+        self.lock = threading.Lock()
+        self.pending = deque()
+        self.tasks = {}
+        self.leases = {}
+        self.codes = {}
+        self.results = Queue.Queue()
+        self.finished = False
+
+    def add_task(self, task_id, code, seeds):
+        with self.lock:
+            self.codes[code_hash(code)] = code
+            self.tasks[task_id] = (code_hash(code), seeds)
+            self.pending.append(task_id)
+
+    def finish(self):
+        with self.lock:
+            self.finished = True
+
+    def __requeue_expired(self):
+        now = time.time()
+        for task_id, (worker, deadline) in self.leases.items():
+            if deadline < now:
+                del self.leases[task_id]
+                self.pending.appendleft(task_id)
+
+    def get_task(self, worker):
+        """Get the next task for a worker.
+
+        Returns:
+            A tuple of the task id, code hash and seeds. None if there is nothing to do right now and DONE if the
+            coordinator is finished.
+        """
+        with self.lock:
+            self.__requeue_expired()
+            while self.pending:
+                task_id = self.pending.popleft()
+                if task_id in self.tasks:
+                    self.leases[task_id] = (worker, time.time() + self.task_timeout)
+                    code_tk, seeds = self.tasks[task_id]
+                    return task_id, code_tk, seeds
+            if self.finished:
+                return DONE
+            return None
+
+    def get_code(self, code_tk):
+        with self.lock:
+            return self.codes[code_tk]
+
+    def put_result(self, worker, task_id, result):
+        with self.lock:
+            # A task that timed out may be finished twice. Only the first result counts.
+            if task_id in self.tasks:
+                del self.tasks[task_id]
+                self.leases.pop(task_id, None)
+                self.results.put((task_id, result))
+
+
+class _WorkerManager(BaseManager):
+    pass
+
+
+_WorkerManager.register("get_board")
+
+
+class Coordinator(object):
+    """Hands out the games of a competition to workers, which can be on any machine that can reach this one.
+
+    Pass a started Coordinator to Comp.sim_competition and start workers with run_worker (or the worker command of
+    CYLGame.run) pointed at its address. A task that is not finished within task_timeout seconds, for example
+    because its worker died, is handed out again.
+
+    The coordinator and its workers send each other pickles, so anyone who can reach the coordinator and knows the
+    authkey can run code on it and on the workers. It only listens on localhost unless another host is given, and
+    it makes a random authkey unless one is given. Keep the authkey secret.
+
+    Ex.
+    >>> coordinator = Coordinator(("10.0.0.5", 5050))
+    >>> coordinator.start()
+    >>> print(coordinator.authkey)  # Give this to the workers
+    >>> sim_competition(compiler, game, gamedb, token, 100, coordinator=coordinator)
+    >>> coordinator.shutdown()
+    """
+    def __init__(self, address=(DEFAULT_HOST, DEFAULT_PORT), authkey=None, task_timeout=600):
+        """
+        Args:
+            address (tuple): The host and port to listen on.
+            authkey (str): The key workers must have to connect. Defaults to a new random key.
+            task_timeout (float): Seconds a worker has to finish a task before it is handed out again.
+        """
+        self.address = address
+        self.authkey = authkey if authkey else new_authkey()
+        self.board = _TaskBoard(task_timeout)
+        self.server = None
+        self.__task_ids = itertools.count()
+
+    def start(self):
+        board = self.board
+
+        class CoordinatorManager(BaseManager):
+            pass
+        CoordinatorManager.register("get_board", callable=lambda: board)
+
+        self.server = CoordinatorManager(address=self.address, authkey=self.authkey).get_server()
+        self.address = self.server.address
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def shutdown(self):
+        """Tell the workers that there is nothing more to do so they exit."""
+        self.board.finish()
+
+    def run_tasks(self, tasks):
+        """Play batches of games on the workers.
+
+        Args:
+            tasks (list): Tuples of (key, compiler, game, code, seeds) like Comp.sim_competition makes. The workers
+                use their own compiler and game.
+
+        Yields:
+            tuple: The key and result (see Comp.play_batch) of each task as it is finished.
+        """
+        assert self.server is not None, "The coordinator must be started first"
+        keys = {}
+        for key, compiler, game, code, seeds in tasks:
+            task_id = next(self.__task_ids)
+            keys[task_id] = key
+            self.board.add_task(task_id, code, seeds)
+        while keys:
+            try:
+                task_id, result = self.board.results.get(timeout=1)
+            except Queue.Empty:
+                continue
+            yield keys.pop(task_id), result
+
+
+def run_worker(game, compiler, address, authkey, poll_interval=1.0, connect_timeout=None,
+               debug=False):
+    """Play batches of games for a coordinator until it is finished or goes away.
+
+    Args:
+        game (class): The game to play. It must be the same game the coordinator is running a competition for.
+        compiler: The compiler for the students' code.
+        address (tuple): The coordinator's host and port.
+        authkey (str): The coordinator's authkey.
+        poll_interval (float): Seconds to wait before asking again when there is no work.
+        connect_timeout (float): Give up if the coordinator can't be reached for this many seconds. Defaults to
+            trying forever, so workers can be started before the coordinator.
+    """
+    worker = socket.gethostname() + ":" + str(multiprocessing.current_process().pid)
+    start = time.time()
+    while True:
+        try:
+            manager = _WorkerManager(address=address, authkey=authkey)
+            manager.connect()
+            break
+        except socket.error:
+            if connect_timeout is not None and time.time() - start > connect_timeout:
+                raise
+            time.sleep(poll_interval)
+    board = manager.get_board()
+    if debug:
+        print("Worker", worker, "connected to", address)
+
+    progs = {}
+    try:
+        while True:
+            task = board.get_task(worker)
+            if task == DONE:
+                break
+            if task is None:
+                time.sleep(poll_interval)
+                continue
+            task_id, code_tk, seeds = task
+            if code_tk not in progs:
+                try:
+                    progs[code_tk] = compiler.compile(board.get_code(code_tk).split("\n"))
+                except Exception as e:
+                    board.put_result(worker, task_id, {"scores": [], "time": 0.0, "turns": 0,
+                                                       "error": "Compile error: " + repr(e)})
+                    continue
+            board.put_result(worker, task_id, play_batch(game, progs[code_tk], seeds))
+            if debug:
+                print("Worker", worker, "finished task", task_id)
+    except (EOFError, IOError):
+        # The coordinator went away.
+        pass
+    if debug:
+        print("Worker", worker, "is done")
+
+
+def start_local_workers(game, compiler, address, authkey, count=None):
+    """Start worker processes on this machine. Useful for testing a coordinator or using every CPU of it.
+
+    Returns:
+        list: The started multiprocessing.Process for each worker.
+    """
+    if count is None:
+        count = multiprocessing.cpu_count()
+    if address[0] in ("", "0.0.0.0"):
+        address = ("127.0.0.1", address[1])
+    workers = []
+    for _ in range(count):
+        worker = multiprocessing.Process(target=run_worker, args=(game, compiler, address, authkey))
+        worker.daemon = True
+        worker.start()
+        workers += [worker]
+    return workers
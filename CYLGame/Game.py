@@ -1,10 +1,16 @@
+from __future__ import print_function
 import tcod
 import tdl
 import tempfile
+import io
+from bisect import bisect_right
+from copy import deepcopy
 import os.path
 import random
 import string
 import sys
+import time
+import timeit
 
 TCOT_ROOT_CONSOLE = None
 TDL_ROOT_CONSOLE = None
@@ -40,6 +46,11 @@ def data_file(filename):
     return resource_path
 
 
+def percentile(samples, pct):
+    """Get the pct percentile of a sorted list of samples (the nearest sample, no interpolation)."""
+    return samples[int(round(pct / 100.0 * (len(samples) - 1)))]
+
+
 class GameLanguage(object):
     LITTLEPY = 0
 
@@ -56,6 +67,10 @@ class Game(object):
     CHAR_HEIGHT = 8
     GAME_TITLE = ""
     CHAR_SET = data_file("fonts/terminal8x8_gs_ro.png")
+    # Set this to False if draw_screen never changes the game, so the score of a game is the same without drawing it.
+    # The runner then skips drawing (and making a console) when it only needs the score. Check it with the
+    # verify-score command before turning it off.
+    SCORE_NEEDS_DRAW = True
 
     def is_running(self):
         """This is how the game runner knows if the game is over.
@@ -118,52 +133,295 @@ class Game(object):
                 ord("z"): "Southwest"}
 
 
+class Replay(object):
+    """A game of a bot stored as its seed and checkpoints of the game, made by GameRunner.run_for_replay.
+
+    Since a game is deterministic for a bot and seed, any frame can be made again by GameRunner.get_replay_frames
+    starting from the checkpoint before it.
+    """
+    def __init__(self, seed, frame_count, checkpoints):
+        """
+        Args:
+            seed (int): The seed of the game.
+            frame_count (int): The number of frames in the game.
+            checkpoints (list): Tuples of the turn, game, bot vars and console before that turn, in order of turn.
+        """
+        self.seed = seed
+        self.frame_count = frame_count
+        self.checkpoints = checkpoints
+        self.checkpoint_turns = [checkpoint[0] for checkpoint in checkpoints]
+
+    def thin(self, max_checkpoints):
+        """Drop evenly spread checkpoints (never the first) until there are at most max_checkpoints.
+
+        This bounds the memory of a replay of a long game. Getting frames gets slower since they are made from
+        further back.
+        """
+        assert max_checkpoints > 0
+        if len(self.checkpoints) > max_checkpoints:
+            step = -(-len(self.checkpoints) // max_checkpoints)
+            self.checkpoints = self.checkpoints[::step]
+            self.checkpoint_turns = [checkpoint[0] for checkpoint in self.checkpoints]
+
+
 class GameRunner(object):
-    def __init__(self, game_class, bot=None):
+    def __init__(self, game_class, bot=None, draw_for_score=None):
+        """
+        Args:
+            game_class (type): The game to run.
+            bot (LPProg): The bot to play the game with.
+            draw_for_score (bool): Whether to draw the screen when only the score is kept. Defaults to the game's
+                SCORE_NEEDS_DRAW.
+        """
         self.game_class = game_class  # type: type
         self.bot = bot  # type: LPProg
+        if draw_for_score is None:
+            draw_for_score = game_class.SCORE_NEEDS_DRAW
+        self.draw_for_score = draw_for_score
 
         self.BOT_CONSTS = self.game_class.get_move_consts()
         self.CONST_NAMES = self.game_class.get_move_names()
+        self.turn_count = 0  # The number of bot turns played by this runner
 
     def __run_for(self, score=False, playback=False, seed=None):
         global TDL_ROOT_CONSOLE
         assert self.bot is not None  # Make sure that we have a bot to run
         assert score != playback
 
-        if not TDL_ROOT_CONSOLE:
+        draw = playback or self.draw_for_score
+        if draw and not TDL_ROOT_CONSOLE:
             TDL_ROOT_CONSOLE = tdl.init(0, 0)
         if not seed:
             seed = random.randint(0, sys.maxint)
         game = self.game_class(random.Random(seed))
 
-
-        console = tdl.Console(game.SCREEN_WIDTH, game.SCREEN_HEIGHT)
+        console = tdl.Console(game.SCREEN_WIDTH, game.SCREEN_HEIGHT) if draw else None
         if playback:
             screen_cap = []
             debug_vars = []
-        vars = {}
-        while game.is_running():
-            result = self.__run_bot_turn(console, game, vars, capture_screen=playback)
-            if result:
-                vars, screen = result
-                if playback:
-                    screen_cap += [screen]
-                    human_vars = {}
-                    for v in vars:
-                        if vars[v] in self.CONST_NAMES:
-                            human_vars[v] = self.CONST_NAMES[vars[v]] + " ("+str(vars[v])+")"
-                        else:
-                            human_vars[v] = vars[v]
-                    debug_vars += [human_vars]
-            else:
-                break
+            # Every frame's debug vars are a list of values in the order of debug_names.
+            debug_names = []
+        # The bot's frame lives for the whole game. The constants are only put in once.
+        vars = dict(self.BOT_CONSTS)
+        for turn, vars, screen in self.__play(game, console, vars, capture_from=0 if playback else None):
+            if playback:
+                screen_cap += [screen]
+                self.__add_debug_vars(debug_names, debug_vars, vars)
 
         if playback:
-            return {"screen": screen_cap, "seed": int2base(seed, 36), "debug": debug_vars}
+            return {"screen": screen_cap, "seed": int2base(seed, 36), "debug": debug_vars, "debug_names": debug_names,
+                    "move_names": self.__get_move_names()}
         else:  # if score
             return game.get_score()
 
+    def __play(self, game, console, vars, turn=0, capture_from=None):
+        """Play the bot's turns until the game is over.
+
+        Args:
+            console (tdl.Console): The console to draw the game on. None to not draw it.
+            turn (int): The number of the first turn.
+            capture_from (int): Capture the screen from this turn on. None to never capture it.
+
+        Yields:
+            tuple: The number of the turn, the bot's vars after it and the screen (None if it wasn't captured).
+        """
+        while game.is_running():
+            self.turn_count += 1
+            capture_screen = capture_from is not None and turn >= capture_from
+            result = self.__run_bot_turn(console, game, vars, capture_screen=capture_screen)
+            if not result:
+                break
+            vars, screen = result
+            yield turn, vars, screen
+            turn += 1
+
+    def __add_debug_vars(self, debug_names, debug_vars, vars):
+        if len(vars) - len(self.BOT_CONSTS) > len(debug_names):
+            for v in vars:
+                if v not in self.BOT_CONSTS and v not in debug_names:
+                    debug_names += [v]
+        debug_vars += [[vars.get(v) for v in debug_names]]
+
+    def __get_move_names(self):
+        return dict((str(value), name) for value, name in self.CONST_NAMES.items())
+
+    @staticmethod
+    def __copy_console(console, w, h):
+        console_copy = tdl.Console(w, h)
+        console_copy.blit(console, 0, 0, w, h, 0, 0)
+        return console_copy
+
+    def run_for_replay(self, seed=None, checkpoint_interval=100):
+        """Runs the given game keeping only a checkpoint of the game every checkpoint_interval turns.
+
+        No screens are captured, so this is about as fast as running for a score. The frames can be made again with
+        get_replay_frames.
+
+        Return:
+            Replay: The replay of the game.
+        """
+        global TDL_ROOT_CONSOLE
+        assert self.bot is not None  # Make sure that we have a bot to run
+        if not TDL_ROOT_CONSOLE:
+            TDL_ROOT_CONSOLE = tdl.init(0, 0)
+        if not seed:
+            seed = random.randint(0, sys.maxint)
+        game = self.game_class(random.Random(seed))
+        w, h = game.SCREEN_WIDTH, game.SCREEN_HEIGHT
+        console = tdl.Console(w, h)
+        vars = dict(self.BOT_CONSTS)
+
+        # The bot's values can be lists or dicts which it changes, so the vars are copied deep.
+        checkpoints = [(0, deepcopy(game), deepcopy(vars), self.__copy_console(console, w, h))]
+        frame_count = 0
+        for turn, vars, screen in self.__play(game, console, vars):
+            frame_count = turn + 1
+            if frame_count % checkpoint_interval == 0:
+                checkpoints += [(frame_count, deepcopy(game), deepcopy(vars), self.__copy_console(console, w, h))]
+        return Replay(seed, frame_count, checkpoints)
+
+    def get_replay_frames(self, replay, start=0, stop=None):
+        """Make the frames start up to stop of a replay again, starting from the closest checkpoint before start.
+
+        Return:
+            dict: The frames like run_for_playback returns them, with "start" (the first frame) and "frame_count" (the
+                number of frames in the whole game).
+        """
+        if stop is None or stop > replay.frame_count:
+            stop = replay.frame_count
+        start = max(0, min(start, stop))
+        # The last checkpoint at or before start.
+        turn, game, vars, console = replay.checkpoints[bisect_right(replay.checkpoint_turns, start) - 1]
+        game = deepcopy(game)
+        vars = deepcopy(vars)
+        console = self.__copy_console(console, game.SCREEN_WIDTH, game.SCREEN_HEIGHT)
+
+        screen_cap = []
+        debug_vars = []
+        debug_names = []
+        if start < stop:
+            for turn, vars, screen in self.__play(game, console, vars, turn=turn, capture_from=start):
+                if turn >= start:
+                    screen_cap += [screen]
+                    self.__add_debug_vars(debug_names, debug_vars, vars)
+                if turn + 1 >= stop:
+                    break
+        return {"screen": screen_cap, "seed": int2base(replay.seed, 36), "debug": debug_vars,
+                "debug_names": debug_names, "move_names": self.__get_move_names(), "start": start,
+                "frame_count": replay.frame_count}
+
+    def run_for_scores(self, times=1, seeds=None):
+        """Runs the given game keeping the score of every game.
+
+        Args:
+            times (int): The number of games to run with random seeds.
+            seeds (list): If given, one game is run for each of these seeds instead.
+
+        Return:
+            list: The score of each game.
+        """
+        if seeds is None:
+            return [self.__run_for(score=True) for _ in range(times)]
+        return [self.__run_for(score=True, seed=seed) for seed in seeds]
+
+    def run_for_scores_lockstep(self, times=1, seeds=None):
+        """Runs the games together, one turn of every game at a time, keeping the score of every game.
+
+        The scores are the same as run_for_scores gives, but the setup is only done once for all of the games and
+        finished games are dropped from the turn loop. Like run_for_scores, the games are only drawn if
+        draw_for_score is set.
+
+        Args:
+            times (int): The number of games to run with random seeds.
+            seeds (list): If given, one game is run for each of these seeds instead.
+
+        Return:
+            list: The score of each game.
+        """
+        global TDL_ROOT_CONSOLE
+        assert self.bot is not None  # Make sure that we have a bot to run
+        if self.draw_for_score and not TDL_ROOT_CONSOLE:
+            TDL_ROOT_CONSOLE = tdl.init(0, 0)
+        if seeds is None:
+            seeds = [None] * times
+        games = []
+        for seed in seeds:
+            if not seed:
+                seed = random.randint(0, sys.maxint)
+            games += [self.game_class(random.Random(seed))]
+        # Every game gets its own console and bot frame.
+        frame = dict(self.BOT_CONSTS)
+        active = [(game, tdl.Console(game.SCREEN_WIDTH, game.SCREEN_HEIGHT) if self.draw_for_score else None,
+                   dict(frame)) for game in games]
+
+        run_bot_turn = self.__run_bot_turn
+        while active:
+            still_running = []
+            for game, console, vars in active:
+                if not game.is_running():
+                    continue
+                self.turn_count += 1
+                result = run_bot_turn(console, game, vars, capture_screen=False)
+                if result:
+                    still_running += [(game, console, result[0])]
+            active = still_running
+        return [game.get_score() for game in games]
+
+    # The phases of a bot turn timed by run_for_profile, in the order they happen.
+    PROFILE_PHASES = ["draw", "capture", "vars", "bot", "handle_key"]
+
+    def run_for_profile(self, seeds, capture_screen=True, draw=None):
+        """Runs a game for each seed timing every phase of every bot turn.
+
+        The phases are drawing the screen (draw), capturing it like playback does (capture), getting the game's
+        variables for the bot (vars), running the bot (bot) and handing its move to the game (handle_key).
+
+        Args:
+            seeds (list): The seed of each game.
+            capture_screen (bool): Capture the screen every turn like run_for_playback does.
+            draw (bool): Draw the screen every turn. Defaults to drawing if the screen is captured or draw_for_score
+                is set, like the runs for playback and scores do. When it isn't drawn the draw phase takes no time.
+
+        Return:
+            dict: Each phase mapped to a list of the seconds it took in every turn.
+        """
+        global TDL_ROOT_CONSOLE
+        assert self.bot is not None  # Make sure that we have a bot to run
+        if draw is None:
+            draw = capture_screen or self.draw_for_score
+        assert draw or not capture_screen, "The screen has to be drawn to capture it"
+        if draw and not TDL_ROOT_CONSOLE:
+            TDL_ROOT_CONSOLE = tdl.init(0, 0)
+        times = dict((phase, []) for phase in self.PROFILE_PHASES)
+        timer = timeit.default_timer
+        for seed in seeds:
+            game = self.game_class(random.Random(seed))
+            console = tdl.Console(game.SCREEN_WIDTH, game.SCREEN_HEIGHT) if draw else None
+            vars = dict(self.BOT_CONSTS)
+            while game.is_running():
+                self.turn_count += 1
+                start = timer()
+                if draw:
+                    game.draw_screen(tcod, console.tcod_console)
+                drawn = timer()
+                if capture_screen:
+                    self.get_screen_array(console)
+                captured = timer()
+                game_vars = game.get_vars_for_bot()
+                got_vars = timer()
+                vars = self.run_bot(vars, game_vars)
+                ran_bot = timer()
+                if "move" not in vars:
+                    break
+                game.handle_key(chr(vars["move"]))
+                end = timer()
+                times["draw"] += [drawn - start]
+                times["capture"] += [captured - drawn]
+                times["vars"] += [got_vars - captured]
+                times["bot"] += [ran_bot - got_vars]
+                times["handle_key"] += [end - ran_bot]
+        return times
+
     def run_for_avg_score(self, times=1):
         """Runs the given game keeping only the scores.
 
@@ -173,20 +431,42 @@ class GameRunner(object):
         Return:
             The return value the average score for the times runs.
         """
-        scores = []
-        # TODO: make this able to run in a pool of threads (So it can be run on multiple CPUs)
-        for t in range(times):
-            scores += [self.__run_for(score=True)]
-        return float(sum(scores*100) / times)/100
+        # To run in a pool of processes see Comp.sim_competition
+        return self.avg_score(self.run_for_scores(times))
+
+    @staticmethod
+    def avg_score(scores):
+        """Get the average of a list of scores. Integer scores are rounded down to two decimal places."""
+        return float(sum(scores*100) / len(scores))/100
 
     def run_for_playback(self, seed=None):
         """Runs the given game saving the screen captures.
 
         Return:
-            The return value is a 3-dimensional list the first dimension is time followed by y and x.
+            dict: "screen" is a 3-dimensional list the first dimension is time followed by y and x. "debug" has the
+                bot's variables for every frame as a list of raw values in the order of "debug_names" (see
+                get_debug_vars). "move_names" maps the move constants to their names.
         """
         return self.__run_for(playback=True, seed=seed)
 
+    def get_debug_vars(self, playback, frame):
+        """Get the bot's variables of a frame of a playback formatted for people.
+
+        Args:
+            playback (dict): The result of run_for_playback.
+            frame (int): The frame.
+
+        Return:
+            dict: The variable names mapped to their values. Move constants are shown by name like "North (119)".
+        """
+        human_vars = {}
+        for v, value in zip(playback["debug_names"], playback["debug"][frame]):
+            if value in self.CONST_NAMES:
+                human_vars[v] = self.CONST_NAMES[value] + " (" + str(value) + ")"
+            else:
+                human_vars[v] = value
+        return human_vars
+
     def run(self, seed=None):
         """Will run the game for a user.
 
@@ -227,22 +507,34 @@ class GameRunner(object):
         if key.char:
             game.handle_key(key.char)
 
-    def __run_bot_turn(self, console, game, prev_vars={}, capture_screen=True):
-        """run_bot will do a single bot turn"""
-        game.draw_screen(tcod, console.tcod_console)
+    def run_bot(self, frame, game_vars):
+        """Run the bot for one turn.
+
+        Args:
+            frame (dict): The bot's variables from the last turn, including the constants. It is updated in place.
+            game_vars (dict): The variables from the game for this turn.
+
+        Returns:
+            dict: The bot's variables after its turn, with any constant the bot changed set back. This is the frame for
+                the next turn.
+        """
+        frame.update(game_vars)
+        nxt_vars = self.bot.run(frame)
+        for key, value in self.BOT_CONSTS.iteritems():
+            if nxt_vars.get(key) != value:
+                nxt_vars[key] = value
+        return nxt_vars
+
+    def __run_bot_turn(self, console, game, frame, capture_screen=True):
+        """run_bot will do a single bot turn. The screen isn't drawn if console is None."""
+        if console is not None:
+            game.draw_screen(tcod, console.tcod_console)
         if capture_screen:
             screen_cap = self.get_screen_array(console)
         else:
             screen_cap = None
 
-        vars = dict(prev_vars)
-        vars.update(self.BOT_CONSTS)
-        vars.update(game.get_vars_for_bot())
-        nxt_vars = self.bot.run(vars)
-
-        # remove consts
-        for key in self.BOT_CONSTS:
-            nxt_vars.pop(key)
+        nxt_vars = self.run_bot(frame, game.get_vars_for_bot())
 
         if "move" in nxt_vars:
             game.handle_key(chr(nxt_vars["move"]))
@@ -255,14 +547,164 @@ def run(game_class):
     def serve(args):
         print("I am going to serve")
         from .Server import serve
-        serve(game_class, host=args.host, port=args.port, game_data_path=args.dbfile)
+        serve(game_class, host=args.host, port=args.port, game_data_path=args.dbfile, cache_size=args.cache_size)
 
     def play(args):
         print("Playing...")
         GameRunner(game_class).run(int(args.seed, 36))
 
+    def load_bot(code_file):
+        """Compile the bot in code_file or the game's default bot if code_file is None."""
+        from littlepython import Compiler
+        if code_file:
+            with io.open(code_file, encoding="utf8") as fp:
+                code = fp.read()
+        else:
+            code = game_class.default_prog_for_bot(GameLanguage.LITTLEPY)
+        return Compiler().compile(code.split("\n"))
+
+    def profile(args):
+        runner = GameRunner(game_class, load_bot(args.code))
+        seeds = range(args.seed, args.seed + args.games)
+        print("Profiling " + str(args.games) + " games...")
+        if not args.capture and not runner.draw_for_score:
+            print("The screen isn't drawn since " + game_class.__name__ + ".SCORE_NEEDS_DRAW is False.")
+        if args.cprofile:
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+        times = runner.run_for_profile(seeds, capture_screen=args.capture)
+        if args.cprofile:
+            profiler.disable()
+            profiler.dump_stats(args.cprofile)
+        turns = len(times["draw"])
+        if not turns:
+            print("The bot didn't play any turns.")
+            return
+        total = sum([sum(times[phase]) for phase in GameRunner.PROFILE_PHASES])
+        print(str(turns) + " turns in %.3fs" % total)
+        print("%-12s %10s %12s %12s %12s %7s" % ("Phase", "Total (s)", "Mean (us)", "p50 (us)", "p95 (us)", "Share"))
+        for phase in GameRunner.PROFILE_PHASES:
+            samples = sorted(times[phase])
+            print("%-12s %10.3f %12.1f %12.1f %12.1f %6.1f%%" % (
+                phase, sum(samples), sum(samples) / turns * 1e6, percentile(samples, 50) * 1e6,
+                percentile(samples, 95) * 1e6, sum(samples) / total * 100 if total else 0))
+        if args.cprofile:
+            print("cProfile stats written to " + args.cprofile)
+
+    def bench(args):
+        import ujson
+        import resource
+        from . import __version__
+        prog = load_bot(args.code)
+        seeds = range(args.seed, args.seed + args.games)
+
+        def latencies(capture_screen):
+            times = GameRunner(game_class, prog).run_for_profile(seeds, capture_screen=capture_screen)
+            turns = sorted([sum(turn) for turn in zip(*[times[phase] for phase in GameRunner.PROFILE_PHASES])])
+            if not turns:
+                return {}
+            return dict(("p" + str(pct) + "_turn_usec", percentile(turns, pct) * 1e6) for pct in (50, 95, 99))
+
+        print("Benchmarking score mode...", file=sys.stderr)
+        runner = GameRunner(game_class, prog)
+        start = timeit.default_timer()
+        runner.run_for_scores(seeds=seeds)
+        seconds = timeit.default_timer() - start
+        score_mode = {"seconds": seconds, "games_per_sec": args.games / seconds, "turns": runner.turn_count,
+                      "turns_per_sec": runner.turn_count / seconds}
+        score_mode.update(latencies(False))
+
+        print("Benchmarking playback mode...", file=sys.stderr)
+        runner = GameRunner(game_class, prog)
+        payload = 0
+        start = timeit.default_timer()
+        for seed in seeds:
+            payload += len(ujson.dumps(runner.run_for_playback(seed=seed)))
+        seconds = timeit.default_timer() - start
+        playback_mode = {"seconds": seconds, "games_per_sec": args.games / seconds, "turns": runner.turn_count,
+                         "turns_per_sec": runner.turn_count / seconds, "payload_bytes": payload,
+                         "payload_bytes_per_game": float(payload) / args.games}
+        playback_mode.update(latencies(True))
+
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == "darwin":
+            # ru_maxrss is in bytes on macOS and kilobytes on Linux.
+            peak_rss /= 1024
+        report = {"config": {"game": game_class.GAME_TITLE, "code": args.code, "games": args.games,
+                             "seed": args.seed, "cylgame_version": __version__, "python": sys.version.split()[0]},
+                  "timestamp": int(time.time()),
+                  "score": score_mode,
+                  "playback": playback_mode,
+                  "peak_rss_kb": peak_rss}
+        if args.output:
+            with open(args.output, "w") as fp:
+                ujson.dump(report, fp, indent=2, escape_forward_slashes=False)
+        else:
+            print(ujson.dumps(report, indent=2, escape_forward_slashes=False))
+
+    def score(args):
+        import ujson
+        from littlepython import Compiler
+        from .Comp import score_bots
+        codes = []
+        for i, code_file in enumerate(args.code):
+            with io.open(code_file, encoding="utf8") as fp:
+                codes += [(i, fp.read())]
+        seeds = range(args.seed, args.seed + args.games)
+        out = open(args.output, "w") if args.output else sys.stdout
+        try:
+            for i, result in score_bots(Compiler(), game_class, codes, seeds, processes=args.processes,
+                                        batch_size=args.batch_size):
+                result["file"] = args.code[i]
+                del result["seeds"]
+                if not args.all_scores:
+                    del result["scores"]
+                out.write(ujson.dumps(result, escape_forward_slashes=False) + "\n")
+                out.flush()
+        finally:
+            if args.output:
+                out.close()
+
+    def verify_score(args):
+        prog = load_bot(args.code)
+        seeds = range(args.seed, args.seed + args.games)
+        scores = {}
+        seconds = {}
+        for draw in [True, False]:
+            print("Scoring " + str(args.games) + " games " + ("with" if draw else "without") + " drawing...")
+            start = timeit.default_timer()
+            scores[draw] = GameRunner(game_class, prog, draw_for_score=draw).run_for_scores(seeds=seeds)
+            seconds[draw] = timeit.default_timer() - start
+        different = [(seed, drawn, not_drawn) for seed, drawn, not_drawn in zip(seeds, scores[True], scores[False])
+                     if drawn != not_drawn]
+        print("With drawing: %.3fs, without drawing: %.3fs (%.2fx)" % (
+            seconds[True], seconds[False], seconds[True] / seconds[False] if seconds[False] else 0))
+        if different:
+            for seed, drawn, not_drawn in different:
+                print("Seed " + str(seed) + ": " + str(drawn) + " with drawing, " + str(not_drawn) + " without")
+            print(str(len(different)) + " of " + str(args.games) + " games scored differently without drawing. " +
+                  "SCORE_NEEDS_DRAW has to stay True.")
+            sys.exit(1)
+        print("All " + str(args.games) + " games scored the same without drawing.")
+        if game_class.SCORE_NEEDS_DRAW:
+            print("Scores are still drawn since " + game_class.__name__ + ".SCORE_NEEDS_DRAW is True.")
+
+    def worker(args):
+        from littlepython import Compiler
+        from .Distributed import run_worker
+        print("Working for " + args.host + ":" + str(args.port) + "...")
+        run_worker(game_class, Compiler(), (args.host, args.port), args.authkey, debug=True)
+
     import argparse
 
+    def seed_int(value):
+        # The runners play a random seed for seed 0, so it can't be used for repeatable games.
+        seed = int(value)
+        if seed < 1:
+            raise argparse.ArgumentTypeError("seeds start at 1, got " + value)
+        return seed
+
     parser = argparse.ArgumentParser(prog=game_class.GAME_TITLE, description='Play ' + game_class.GAME_TITLE + '.')
     subparsers = parser.add_subparsers(help='What do you what to do?')
     parser_play = subparsers.add_parser('play', help='Play ' + game_class.GAME_TITLE + ' with a GUI')
@@ -273,7 +715,59 @@ def run(game_class):
     parser_serve.add_argument('-p', '--port', nargs="?", type=int, help='Port to serve on', default=5000)
     parser_serve.add_argument('-db', '--dbfile', nargs="?", type=str, help='The root path of the game database', default="temp_game")
     parser_serve.add_argument('--host', nargs="?", type=str, help='The mask to host to', default='127.0.0.1')
+    parser_serve.add_argument('--cache-size', nargs="?", type=int, default=0,
+                              help='Number of game database reads to keep in memory (0 disables the cache)')
     parser_serve.set_defaults(func=serve)
+    parser_profile = subparsers.add_parser('profile', help='Time each phase of the turns of a bot playing ' +
+                                           game_class.GAME_TITLE + '.')
+    parser_profile.add_argument('-c', '--code', nargs="?", type=str, default=None,
+                                help='The bot\'s code file. Defaults to the game\'s example bot')
+    parser_profile.add_argument('-n', '--games', nargs="?", type=int, default=10, help='Number of games to play')
+    parser_profile.add_argument('-s', '--seed', nargs="?", type=seed_int, default=1,
+                                help='The seed of the first game. The games use this seed and the ones after it')
+    parser_profile.add_argument('--capture', action='store_true',
+                                help='Capture the screen every turn like the playback in the browser does')
+    parser_profile.add_argument('--cprofile', nargs="?", type=str, default=None,
+                                help='Also write cProfile stats to this file (for pstats, snakeviz or flameprof)')
+    parser_profile.set_defaults(func=profile)
+    parser_bench = subparsers.add_parser('bench', help='Measure how fast ' + game_class.GAME_TITLE +
+                                         ' simulates and print the results as JSON.')
+    parser_bench.add_argument('-c', '--code', nargs="?", type=str, default=None,
+                              help='The bot\'s code file. Defaults to the game\'s example bot')
+    parser_bench.add_argument('-n', '--games', nargs="?", type=int, default=20, help='Number of games per mode')
+    parser_bench.add_argument('-s', '--seed', nargs="?", type=seed_int, default=1,
+                              help='The seed of the first game. The games use this seed and the ones after it')
+    parser_bench.add_argument('-o', '--output', nargs="?", type=str, default=None, help='Write the JSON report here')
+    parser_bench.set_defaults(func=bench)
+    parser_score = subparsers.add_parser('score', help='Score many bots at ' + game_class.GAME_TITLE +
+                                         ' and print a JSON line for each bot as it finishes.')
+    parser_score.add_argument('code', nargs="+", type=str, help='The bots\' code files')
+    parser_score.add_argument('-n', '--games', nargs="?", type=int, default=100,
+                              help='Number of games to average each bot\'s score over')
+    parser_score.add_argument('-s', '--seed', nargs="?", type=seed_int, default=1,
+                              help='The seed of the first game. Every bot plays this seed and the ones after it')
+    parser_score.add_argument('-p', '--processes', nargs="?", type=int, default=None,
+                              help='Number of processes to play games in. Defaults to the number of CPUs')
+    parser_score.add_argument('--batch-size', nargs="?", type=int, default=10,
+                              help='Number of games a process plays at a time')
+    parser_score.add_argument('--all-scores', action='store_true', help='Include the score of every game')
+    parser_score.add_argument('-o', '--output', nargs="?", type=str, default=None,
+                              help='Write the JSON lines here instead of to stdout')
+    parser_score.set_defaults(func=score)
+    parser_verify = subparsers.add_parser('verify-score', help='Check that ' + game_class.GAME_TITLE +
+                                          ' scores the same without drawing the screen.')
+    parser_verify.add_argument('-c', '--code', nargs="?", type=str, default=None,
+                               help='The bot\'s code file. Defaults to the game\'s example bot')
+    parser_verify.add_argument('-n', '--games', nargs="?", type=int, default=100, help='Number of games to compare')
+    parser_verify.add_argument('-s', '--seed', nargs="?", type=seed_int, default=1,
+                               help='The seed of the first game. The games use this seed and the ones after it')
+    parser_verify.set_defaults(func=verify_score)
+    parser_worker = subparsers.add_parser('worker', help='Play competition games for a coordinator.')
+    parser_worker.add_argument('--host', nargs="?", type=str, help='The coordinator\'s host', default='127.0.0.1')
+    parser_worker.add_argument('-p', '--port', nargs="?", type=int, help='The coordinator\'s port', default=5050)
+    parser_worker.add_argument('--authkey', type=str, required=True,
+                               help='The coordinator\'s authkey (it is printed when the coordinator starts)')
+    parser_worker.set_defaults(func=worker)
 
     args = parser.parse_args()
     args.func(args)
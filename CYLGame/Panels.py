@@ -1,26 +1,73 @@
-from collections import defaultdict, namedtuple, Mapping
+from collections import defaultdict, namedtuple, Mapping, deque
+from itertools import islice
 from functools import reduce
-from copy import copy
+from copy import copy, deepcopy
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 DEFAULT_CHAR = ' '
 
 
 class ColoredChar(object):
-    def __init__(self, char=None, foreground=None, background=None):
+    """
+    A char with its foreground and background colors. ColoredChars can't be changed once they are made, so the same
+    instance is shared for every (char, foreground, background) that is used a lot, like the default char of a map.
+    Subclasses are interned separately, so making a subclass never gives back a plain ColoredChar.
+
+    Like ==, which only compares the chars, the hash only uses the char. So ColoredChars that only differ in color
+    are the same key in a set or dict. (They used to be hashed by identity, which made every ColoredChar a different
+    key even though == said they were equal.)
+    """
+    __slots__ = ("char", "foreground", "background")
+    INTERN_LIMIT = 4096
+    _interned = {}
+
+    def __new__(cls, char=None, foreground=None, background=None):
         if isinstance(char, ColoredChar):
-            self.char = char.char
-            self.foreground = char.foreground
-            self.background = char.background
-        else:
-            self.char = char
-            self.foreground = foreground
-            self.background = background
+            if isinstance(char, cls):
+                return char
+            char, foreground, background = char.char, char.foreground, char.background
+        key = (cls, char, foreground, background)
+        try:
+            return cls._interned[key]
+        except KeyError:
+            pass
+        except TypeError:
+            # Colors which can't be hashed (like lists) are not interned.
+            key = None
+        self = super(ColoredChar, cls).__new__(cls)
+        object.__setattr__(self, "char", char)
+        object.__setattr__(self, "foreground", foreground)
+        object.__setattr__(self, "background", background)
+        if key is not None and len(cls._interned) < cls.INTERN_LIMIT:
+            cls._interned[key] = self
+        return self
+
+    def __init__(self, char=None, foreground=None, background=None):
+        pass
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ColoredChar can't be changed, make a new one instead")
+
+    def __delattr__(self, name):
+        raise AttributeError("ColoredChar can't be changed, make a new one instead")
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return type(self), (self.char, self.foreground, self.background)
 
     def __str__(self):
         return self.char
 
     def __iter__(self):
-        return [self.char, self.foreground, self.background].__iter__()
+        return iter((self.char, self.foreground, self.background))
 
     def __repr__(self):
         return "<ColoredChar '" + str(self.char) + "', " + str(self.foreground) + ", " + str(self.background) + ">"
@@ -29,9 +76,18 @@ class ColoredChar(object):
     def __eq__(self, other):
         if isinstance(other, str):
             return self.char == other
-        else:
-            assert isinstance(other, ColoredChar)
+        elif isinstance(other, ColoredChar):
             return self.char == other.char
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+    def __hash__(self):
+        return hash(self.char)
 
 
 # WARNING: this does not do bounds checking
@@ -42,7 +98,18 @@ class Map(object):
                 positions where that char is located.
     p_to_char:  The is a dictionary which has a position(tuple with two elements: x and y) as a key and the current
                 ColoredChar as the value.
+    buckets:    This is a dictionary which has a (char, bucket x, bucket y) tuple as a key and the value is a set of the
+                positions of that char in that BUCKET_SIZE by BUCKET_SIZE square of the map. It is used for the
+                spatial queries (get_nearest_pos, get_pos_in_rect and get_pos_in_radius).
+    undo_log:   While there are snapshots this is a list of (position, ColoredChar or None if it was not set) for
+                every cell before it was changed. None when there are no snapshots.
+    snapshots:  The stack of snapshots that can still be restored, outermost first. Each is a (snapshot id, length of
+                undo_log when it was made) tuple.
     """
+    BUCKET_SIZE = 8
+    # Chars with at most this many positions are searched by going through all of them instead of the buckets.
+    SCAN_LIMIT = 32
+
     def __init__(self, default_char=DEFAULT_CHAR, default_foreground=(255, 255, 255), default_background=(0, 0, 0), default_colored_char=None):
         if default_colored_char:
             self.default_char = default_colored_char.char
@@ -52,9 +119,15 @@ class Map(object):
             self.default_char = default_char
             self.default_foreground = default_foreground
             self.default_background = default_background
+        self.default_colored_char = ColoredChar(self.default_char, self.default_foreground, self.default_background)
         self.char_to_ps = defaultdict(set)
-        self.p_to_char = defaultdict(lambda: ColoredChar(self.default_char, self.default_foreground, self.default_background))
+        self.buckets = defaultdict(set)
+        self.p_to_char = defaultdict(lambda: self.default_colored_char)
         self.changes = {}
+        self.undo_log = None
+        self.snapshots = []
+        # Snapshot ids are never reused, so an old id can't restore the wrong state.
+        self.last_snapshot_id = 0
 
     def __setitem__(self, key, value):
         self.add(value, key)
@@ -80,21 +153,136 @@ class Map(object):
             assert type(colored_char) == ColoredChar
         assert type(pos) == tuple
 
-        if pos in self.p_to_char.keys():
+        if pos in self.p_to_char:
             self.rm_char(pos)
-        self.char_to_ps[char].add(pos)
+        if self.undo_log is not None:
+            self.undo_log.append((pos, None))
+        self.index_char(char, pos)
         self.p_to_char[pos] = colored_char
         self.changes[pos] = colored_char
 
     # pos must be tuple
     def rm_char(self, pos):
         assert type(pos) == tuple
-        colored_char = self.p_to_char[pos]
-        del self.p_to_char[pos]
+        if pos not in self.p_to_char:
+            return
+        colored_char = self.p_to_char.pop(pos)
+        if self.undo_log is not None:
+            self.undo_log.append((pos, colored_char))
         char = colored_char.char
         if char in self.char_to_ps and pos in self.char_to_ps[char]:
-            self.char_to_ps[char].remove(pos)
-            self.changes[pos] = self.default_char
+            self.unindex_char(char, pos)
+            self.changes[pos] = self.default_colored_char
+
+    def snapshot(self):
+        """Remember the current state of the map so it can be restored later.
+
+        From now on the old value of every changed cell is logged, so a snapshot costs nothing up front and restoring
+        it costs the number of changes since it was made. Snapshots can be nested. Every snapshot should be restored
+        or released, innermost first. Logging stops when the outermost one is restored or released or
+        drop_snapshots is called, so don't leave a snapshot open for the rest of a game.
+
+        Only one state of the map is kept, so a snapshot can only go back. To have two states of the map at the same
+        time use fork.
+
+        Ex.
+        >>> snapshot = game_map.snapshot()
+        >>> game_map[(1, 1)] = "@"  # Try a move
+        >>> game_map.restore(snapshot)  # Undo it
+
+        Returns:
+            int: The snapshot id to pass to restore or release.
+        """
+        if self.undo_log is None:
+            self.undo_log = []
+        self.last_snapshot_id += 1
+        self.snapshots.append((self.last_snapshot_id, len(self.undo_log)))
+        return self.last_snapshot_id
+
+    def get_snapshot_depth(self, snapshot):
+        """Get the index of snapshot in the snapshots stack or raise a ValueError if it can't be restored."""
+        for depth, (snapshot_id, mark) in enumerate(self.snapshots):
+            if snapshot_id == snapshot:
+                return depth
+        raise ValueError("Invalid snapshot: " + str(snapshot))
+
+    def end_snapshots(self, depth):
+        """Forget the snapshots from depth on and stop logging if there are none left."""
+        del self.snapshots[depth:]
+        if not self.snapshots:
+            self.undo_log = None
+
+    def restore(self, snapshot):
+        """Put the map back the way it was when snapshot was made.
+
+        The restored cells are added to the diff so panels draw them again. The snapshot and every snapshot made after
+        it can't be restored anymore.
+        """
+        depth = self.get_snapshot_depth(snapshot)
+        mark = self.snapshots[depth][1]
+        undo_log = self.undo_log
+        # Don't log the changes made while undoing.
+        self.undo_log = None
+        try:
+            while len(undo_log) > mark:
+                pos, colored_char = undo_log.pop()
+                if colored_char is None:
+                    self.rm_char(pos)
+                else:
+                    self.add(colored_char, pos)
+        finally:
+            self.undo_log = undo_log
+            self.end_snapshots(depth)
+
+    def release(self, snapshot):
+        """Keep the changes made since snapshot and forget it and every snapshot made after it."""
+        self.end_snapshots(self.get_snapshot_depth(snapshot))
+
+    def drop_snapshots(self):
+        """Forget every snapshot and stop logging changes."""
+        self.end_snapshots(0)
+
+    # The containers that fork copies itself. They only hold immutable values (positions and ColoredChars).
+    FORK_CONTAINERS = ("p_to_char", "char_to_ps", "buckets", "changes", "undo_log", "snapshots")
+
+    def fork(self):
+        """Make an independent copy of the map that can be changed without changing this one.
+
+        The cells are copied with dict and set copies instead of copying every position and ColoredChar, so this is
+        much faster than a generic deepcopy. deepcopy of a map (or of a game holding maps) uses it too.
+
+        Returns:
+            Map: The copy.
+        """
+        return deepcopy(self)
+
+    def __deepcopy__(self, memo):
+        forked = object.__new__(type(self))
+        memo[id(self)] = forked
+        for name, value in self.__dict__.items():
+            if name not in self.FORK_CONTAINERS:
+                forked.__dict__[name] = deepcopy(value, memo)
+        self.fork_cells(forked)
+        forked.char_to_ps = defaultdict(set, [(char, set(ps)) for char, ps in self.char_to_ps.iteritems()])
+        forked.buckets = defaultdict(set, [(key, set(ps)) for key, ps in self.buckets.iteritems()])
+        forked.changes = dict(self.changes)
+        forked.undo_log = list(self.undo_log) if self.undo_log is not None else None
+        forked.snapshots = list(self.snapshots)
+        return forked
+
+    def fork_cells(self, forked):
+        """Copy the cells into forked (see fork)."""
+        forked.p_to_char = defaultdict(lambda: forked.default_colored_char, self.p_to_char)
+
+    def index_char(self, char, pos):
+        self.char_to_ps[char].add(pos)
+        self.buckets[(char, pos[0] // self.BUCKET_SIZE, pos[1] // self.BUCKET_SIZE)].add(pos)
+
+    def unindex_char(self, char, pos):
+        self.char_to_ps[char].discard(pos)
+        bucket = self.buckets.get((char, pos[0] // self.BUCKET_SIZE, pos[1] // self.BUCKET_SIZE))
+        if bucket is not None:
+            bucket.discard(pos)
 
     # returns a set of pos
     def get_all_pos(self, char):
@@ -104,10 +292,225 @@ class Map(object):
         assert len(char) == 1
         return copy(self.char_to_ps[char])
 
+    def __ring(self, bx, by, r):
+        """The buckets r buckets away from (bx, by)."""
+        if r == 0:
+            return [(bx, by)]
+        ring = []
+        for x in range(bx - r, bx + r + 1):
+            ring += [(x, by - r), (x, by + r)]
+        for y in range(by - r + 1, by + r):
+            ring += [(bx - r, y), (bx + r, y)]
+        return ring
+
+    def get_nearest_pos(self, char, pos, max_dist=None):
+        """Find the position of char closest to pos (by straight line distance).
+
+        Args:
+            char (str or ColoredChar): The char to look for.
+            pos (tuple): The position to measure from.
+            max_dist (float): Don't return positions that are further than this.
+
+        Returns:
+            tuple: The closest position or None if there is no char (within max_dist). Ties go to the smallest
+                position so that games stay deterministic.
+        """
+        if isinstance(char, ColoredChar):
+            char = char.char
+        positions = self.char_to_ps.get(char)
+        if not positions:
+            return None
+        x, y = pos
+        best = None
+        if len(positions) <= self.SCAN_LIMIT:
+            best = min([((px - x) ** 2 + (py - y) ** 2, (px, py)) for px, py in positions])
+        else:
+            bx, by = x // self.BUCKET_SIZE, y // self.BUCKET_SIZE
+            r = 0
+            while True:
+                if r > 0:
+                    # Nothing in ring r can be closer than this.
+                    closest = (r - 1) * self.BUCKET_SIZE + 1
+                    if best is not None and closest ** 2 > best[0]:
+                        break
+                    if max_dist is not None and closest > max_dist:
+                        break
+                for bucket_pos in self.__ring(bx, by, r):
+                    for px, py in self.buckets.get((char,) + bucket_pos, ()):
+                        candidate = ((px - x) ** 2 + (py - y) ** 2, (px, py))
+                        if best is None or candidate < best:
+                            best = candidate
+                r += 1
+        if best is None or (max_dist is not None and best[0] > max_dist ** 2):
+            return None
+        return best[1]
+
+    def get_pos_in_rect(self, char, x, y, w, h):
+        """Get the positions of char in the w by h rectangle with its top left corner at (x, y).
+
+        Returns:
+            set: The positions.
+        """
+        if isinstance(char, ColoredChar):
+            char = char.char
+        positions = self.char_to_ps.get(char)
+        if not positions:
+            return set()
+        min_bx, max_bx = x // self.BUCKET_SIZE, (x + w - 1) // self.BUCKET_SIZE
+        min_by, max_by = y // self.BUCKET_SIZE, (y + h - 1) // self.BUCKET_SIZE
+        if len(positions) <= self.SCAN_LIMIT or (max_bx - min_bx + 1) * (max_by - min_by + 1) > len(positions):
+            candidates = positions
+        else:
+            candidates = []
+            for bx in range(min_bx, max_bx + 1):
+                for by in range(min_by, max_by + 1):
+                    candidates += self.buckets.get((char, bx, by), ())
+        return set([(px, py) for px, py in candidates if x <= px < x + w and y <= py < y + h])
+
+    def get_pos_in_radius(self, char, pos, radius):
+        """Get the positions of char that are at most radius away from pos (by straight line distance).
+
+        Returns:
+            set: The positions.
+        """
+        x, y = pos
+        r = int(radius)
+        return set([(px, py) for px, py in self.get_pos_in_rect(char, x - r, y - r, 2 * r + 1, 2 * r + 1)
+                    if (px - x) ** 2 + (py - y) ** 2 <= radius ** 2])
+
+    @staticmethod
+    def get_line(start, end):
+        """Get the positions on the line from start to end (both included) using Bresenham's line algorithm."""
+        x, y = start
+        end_x, end_y = end
+        dx, dy = abs(end_x - x), -abs(end_y - y)
+        step_x = 1 if x < end_x else -1
+        step_y = 1 if y < end_y else -1
+        err = dx + dy
+        line = [(x, y)]
+        while (x, y) != (end_x, end_y):
+            double_err = 2 * err
+            if double_err >= dy:
+                err += dy
+                x += step_x
+            if double_err <= dx:
+                err += dx
+                y += step_y
+            line += [(x, y)]
+        return line
+
+    def is_line_blocked(self, start, end, blocking_chars):
+        """Check if any of blocking_chars is between start and end, like a wall blocking a line of sight.
+
+        Args:
+            blocking_chars (str or list): The chars that block the line. The chars at start and end don't count.
+
+        Returns:
+            bool: True if the line is blocked.
+        """
+        for pos in self.get_line(start, end)[1:-1]:
+            if self.get_char_at(pos).char in blocking_chars:
+                return True
+        return False
+
     # will return default_char if the position is not set
     # Will return a ColoredChar
     def get_char_at(self, pos):
-        return copy(self.p_to_char[pos])
+        # ColoredChars can't be changed so there is no need to copy it.
+        return self.p_to_char.get(pos, self.default_colored_char)
+
+
+class ArrayMap(Map):
+    """
+    A Map of a fixed size which keeps its cells in a flat list of ColoredChars instead of a dictionary. Setting or
+    removing a cell is a list index instead of dict insertions and deletions, so it is faster for maps that are busy
+    and mostly full. Reads are about as fast as Map's. It has the same char_to_ps index, spatial queries, get_diff,
+    snapshots and fork as Map.
+
+    Positions outside of the w by h map can't be set (IndexError), but reading them gives the default char like Map.
+    """
+    FORK_CONTAINERS = Map.FORK_CONTAINERS + ("cells",)
+
+    def __init__(self, w, h, default_char=DEFAULT_CHAR, default_foreground=(255, 255, 255), default_background=(0, 0, 0), default_colored_char=None):
+        super(ArrayMap, self).__init__(default_char, default_foreground, default_background, default_colored_char)
+        self.init_cells(w, h)
+
+    def init_cells(self, w, h):
+        self.p_to_char = None
+        self.map_w = w
+        self.map_h = h
+        # None marks a cell that has not been set.
+        self.cells = [None] * (w * h)
+
+    def fork_cells(self, forked):
+        forked.p_to_char = None
+        forked.cells = list(self.cells)
+
+    # pos must be tuple
+    def add(self, char, pos):
+        if type(char) == str:
+            colored_char = ColoredChar(char)
+        else:
+            colored_char = char
+            char = colored_char.char
+            assert type(colored_char) == ColoredChar
+        assert type(pos) == tuple
+        x, y = pos
+        if not (0 <= x < self.map_w and 0 <= y < self.map_h):
+            raise IndexError("Position " + str(pos) + " is outside of the map")
+
+        i = x + y * self.map_w
+        old = self.cells[i]
+        if self.undo_log is not None:
+            self.undo_log.append((pos, old))
+        if old is not None:
+            self.unindex_char(old.char, pos)
+        self.cells[i] = colored_char
+        self.index_char(char, pos)
+        self.changes[pos] = colored_char
+
+    # pos must be tuple
+    def rm_char(self, pos):
+        assert type(pos) == tuple
+        x, y = pos
+        if not (0 <= x < self.map_w and 0 <= y < self.map_h):
+            return
+        i = x + y * self.map_w
+        old = self.cells[i]
+        if old is not None:
+            if self.undo_log is not None:
+                self.undo_log.append((pos, old))
+            self.unindex_char(old.char, pos)
+            self.cells[i] = None
+            self.changes[pos] = self.default_colored_char
+
+    # will return default_char if the position is not set
+    # Will return a ColoredChar
+    def get_char_at(self, pos):
+        x, y = pos
+        if 0 <= x < self.map_w and 0 <= y < self.map_h:
+            colored_char = self.cells[x + y * self.map_w]
+            if colored_char is not None:
+                return colored_char
+        return self.default_colored_char
+
+
+def rect_intersection(a, b):
+    """Get the overlap of two (x, y, w, h) rectangles or None if they don't overlap."""
+    x, y = max(a[0], b[0]), max(a[1], b[1])
+    w, h = min(a[0] + a[2], b[0] + b[2]) - x, min(a[1] + a[3], b[1] + b[3]) - y
+    if w <= 0 or h <= 0:
+        return None
+    return x, y, w, h
+
+
+def bounding_rect(positions):
+    """Get the smallest (x, y, w, h) rectangle around the positions or None if there are none."""
+    if not positions:
+        return None
+    xs = [pos[0] for pos in positions]
+    ys = [pos[1] for pos in positions]
+    return min(xs), min(ys), max(xs) - min(xs) + 1, max(ys) - min(ys) + 1
 
 
 class PanelPadding(object):
@@ -286,6 +689,31 @@ class Panel(Map):
             self.h -= self.padding[PanelPadding.BOTTOM]
         if PanelPadding.RIGHT in self.padding:
             self.w -= self.padding[PanelPadding.RIGHT]
+        self.chrome_drawn = False
+        # Set by Compositor. Only panels in a Compositor can trust that what they drew is still on the console.
+        self.composited = False
+
+    def get_rect(self):
+        """The (x, y, w, h) rectangle of the whole panel (with its border and padding) on the console."""
+        return self.real_x, self.real_y, self.real_w, self.real_h
+
+    def get_content_rect(self):
+        """The (x, y, w, h) rectangle inside the border and padding on the console."""
+        return self.x, self.y, self.w, self.h
+
+    def invalidate(self):
+        """Draw the whole panel on the next redraw. Use this if something else drew over the panel."""
+        self.chrome_drawn = False
+
+    def damage(self, rect):
+        """Draw the part of the panel in rect (on the console) again on the next redraw.
+
+        Compositor uses this when a panel under this one changed. Panels draw their content again, Panel only has
+        its border and padding.
+        """
+        overlap = rect_intersection(rect, self.get_rect())
+        if overlap is not None and rect_intersection(overlap, self.get_content_rect()) != overlap:
+            self.chrome_drawn = False
 
     def draw_colored_char(self, colored_char, pos, libtcod, console):
         # TODO: add asserts for these
@@ -302,7 +730,100 @@ class Panel(Map):
         else:
             libtcod.console_set_char_background(console, x, y, self.default_background)
 
+    def draw_colored_chars(self, cells, libtcod, console, rect=None):
+        """Draw many cells at once.
+
+        If the console has ch, fg and bg arrays (like tcod's Console) the cells are written into them with one
+        assignment per array. If the cells fill rect, they are written with libtcod's console_fill_char,
+        console_fill_foreground and console_fill_background into a console of rect's size which is then blitted
+        into place, so a full redraw takes a handful of libtcod calls. Otherwise each cell is drawn with a single
+        console_put_char_ex call instead of the three calls draw_colored_char makes, which is best for a few cells.
+
+        Args:
+            cells (list): Tuples of (colored_char, pos) where pos is the position on the console.
+            rect (tuple): The (x, y, w, h) rectangle of the console that cells has exactly one cell for every
+                position of, if it does.
+        """
+        cells = [(char,
+                  foreground if foreground is not None else self.default_foreground,
+                  background if background is not None else self.default_background,
+                  pos) for (char, foreground, background), pos in cells]
+        if rect is not None:
+            assert len(cells) == rect[2] * rect[3]
+        if numpy is not None and hasattr(console, "ch") and hasattr(console, "fg") and hasattr(console, "bg"):
+            if cells:
+                chars, fgs, bgs, positions = zip(*cells)
+                xs, ys = numpy.array(positions).T
+                console.fg[ys, xs] = fgs
+                console.bg[ys, xs] = bgs
+                has_char = numpy.array([char is not None for char in chars])
+                console.ch[ys[has_char], xs[has_char]] = [ord(char) if isinstance(char, str) else char
+                                                         for char in chars if char is not None]
+        elif rect is not None and cells and hasattr(libtcod, "console_fill_char") and \
+                all(char is not None for char, foreground, background, pos in cells):
+            self.fill_rect(cells, rect, libtcod, console)
+        elif hasattr(libtcod, "console_put_char_ex"):
+            for char, foreground, background, (x, y) in cells:
+                if char is None:
+                    self.draw_colored_char((char, foreground, background), (x, y), libtcod, console)
+                else:
+                    libtcod.console_put_char_ex(console, x, y, char, foreground, background)
+        else:
+            for char, foreground, background, pos in cells:
+                self.draw_colored_char((char, foreground, background), pos, libtcod, console)
+
+    @staticmethod
+    def fill_rect(cells, rect, libtcod, console):
+        """Write cells that fill rect with libtcod's console_fill_* functions (see draw_colored_chars).
+
+        Args:
+            cells (list): Tuples of (char, foreground, background, pos) with no None in them.
+            rect (tuple): The (x, y, w, h) rectangle of the console that the cells fill.
+        """
+        rect_x, rect_y, w, h = rect
+        chars = [0] * (w * h)
+        fg_r, fg_g, fg_b = [0] * (w * h), [0] * (w * h), [0] * (w * h)
+        bg_r, bg_g, bg_b = [0] * (w * h), [0] * (w * h), [0] * (w * h)
+        for char, foreground, background, (x, y) in cells:
+            i = (x - rect_x) + (y - rect_y) * w
+            chars[i] = ord(char) if isinstance(char, str) else char
+            fg_r[i], fg_g[i], fg_b[i] = foreground
+            bg_r[i], bg_g[i], bg_b[i] = background
+        whole_console = rect_x == 0 and rect_y == 0 and libtcod.console_get_width(console) == w and \
+            libtcod.console_get_height(console) == h
+        # console_fill_* always fill a whole console, so a smaller rect is filled into a console of its own first.
+        target = console if whole_console else libtcod.console_new(w, h)
+        libtcod.console_fill_char(target, chars)
+        libtcod.console_fill_foreground(target, fg_r, fg_g, fg_b)
+        libtcod.console_fill_background(target, bg_r, bg_g, bg_b)
+        if not whole_console:
+            libtcod.console_blit(target, 0, 0, w, h, console, rect_x, rect_y)
+            libtcod.console_delete(target)
+
     def redraw(self, libtcod, console):
+        """Draw whatever changed since the last redraw.
+
+        The border and padding are drawn every time, unless the panel is in a Compositor. Then they are only drawn the
+        first time and when something drew over them, since the game may clear the console between frames otherwise.
+
+        Returns:
+            list: The (x, y, w, h) rectangles of the console that were drawn.
+        """
+        if self.chrome_drawn and self.composited:
+            return []
+        self.draw_chrome(libtcod, console)
+        self.chrome_drawn = True
+        return [self.get_rect()]
+
+    def draw_chrome(self, libtcod, console):
+        """Draw the border and clear the padding."""
+        padding = []
+        for x in range(self.real_x, self.real_x + self.real_w):
+            for y in range(self.real_y, self.real_y + self.real_h):
+                if not (self.x <= x < self.x + self.w and self.y <= y < self.y + self.h):
+                    padding += [(self.default_colored_char, (x, y))]
+        self.draw_colored_chars(padding, libtcod, console)
+
         if PanelBorder.TOP in self.border:
             for i in range(self.real_w):
                 libtcod.console_put_char(console, self.real_x + i, self.real_y, self.border[PanelBorder.TOP],
@@ -339,39 +860,73 @@ class MapPanel(Panel):
         # self.first_draw()
         self.is_first = True
 
+    def invalidate(self):
+        super(MapPanel, self).invalidate()
+        self.is_first = True
+
+    def damage(self, rect):
+        super(MapPanel, self).damage(rect)
+        overlap = rect_intersection(rect, self.get_content_rect())
+        if overlap is not None:
+            x, y, w, h = overlap
+            for map_x in range(x - self.x, x - self.x + w):
+                for map_y in range(y - self.y, y - self.y + h):
+                    self.changes[(map_x, map_y)] = self[(map_x, map_y)]
+
     def first_draw(self, libtcod, console):
-        # pass
+        cells = []
         for x in range(self.w):
             for y in range(self.h):
-                self.draw_colored_char(self[(x, y)], (self.x + x, self.y + y), libtcod, console)
+                cells += [(self[(x, y)], (self.x + x, self.y + y))]
+        self.draw_colored_chars(cells, libtcod, console, rect=self.get_content_rect())
 
     def redraw(self, libtcod, console):
-        super(MapPanel, self).redraw(libtcod, console)
+        rects = super(MapPanel, self).redraw(libtcod, console)
         if self.is_first:
             self.first_draw(libtcod, console)
             self.is_first = False
+            # The first draw already drew every change.
+            self.get_diff()
+            return rects + [self.get_content_rect()]
         diff = self.get_diff()
+        cells = []
+        out_of_bounds = False
         for pos in diff:
-            colored_char = diff[pos]
-            # if not colored_char.foreground:
-            #     colored_char = ColoredChar(colored_char.char, self.default_foreground, colored_char.background)
-            # if not colored_char.background:
-            #     colored_char = ColoredChar(colored_char.char, colored_char.foreground, self.default_background)
-
             # Check that the position is in bounds
             if 0 <= pos[0] < self.w and 0 <= pos[1] < self.h:
-                self.draw_colored_char(colored_char, (self.x + pos[0], self.y + pos[1]), libtcod, console)
-                # libtcod.console_put_char(console, self.x + pos[0], self.y + pos[1], char, libtcod.BKGND_NONE)
+                cells += [(diff[pos], (self.x + pos[0], self.y + pos[1]))]
             else:
-                raise Warning("Char out of bounds: Decided to skip drawing it!")
+                out_of_bounds = True
+        # The positions are all different, so if there is one for every cell the whole panel is drawn.
+        full = len(cells) == self.w * self.h
+        self.draw_colored_chars(cells, libtcod, console, rect=self.get_content_rect() if full else None)
+        if out_of_bounds:
+            raise Warning("Char out of bounds: Decided to skip drawing it!")
+        if cells:
+            rects += [bounding_rect([pos for colored_char, pos in cells])]
+        return rects
+
+
+class ArrayMapPanel(ArrayMap, MapPanel):
+    """A MapPanel which keeps its cells like an ArrayMap. Only the area inside the border and padding can be set."""
+    def __init__(self, x, y, w, h, default_char=DEFAULT_CHAR, border=PanelBorder(), padding=PanelPadding(), default_colored_char=None):
+        MapPanel.__init__(self, x, y, w, h, default_char, border, padding, default_colored_char=default_colored_char)
+        self.init_cells(self.w, self.h)
 
 
 class MessagePanel(Panel):
-    def __init__(self, x, y, w, h, default_char=DEFAULT_CHAR, border=PanelBorder(), padding=PanelPadding.create(*[1]*4)):
+    def __init__(self, x, y, w, h, default_char=DEFAULT_CHAR, border=PanelBorder(), padding=PanelPadding.create(*[1]*4), history=None):
+        """
+        Args:
+            history (int): The number of messages to keep (at least one). Older messages are dropped. Defaults to the
+                number that can be shown.
+        """
         super(MessagePanel, self).__init__(x, y, w, h, default_char, border, padding)
-        self.msgs = []
         self.rows = self.h
         self.max_len = self.w
+        self.msgs = deque(maxlen=max(1, history or self.rows))
+        # The line last drawn on each row so only changed rows are drawn again when in a Compositor.
+        self.drawn = [None] * self.rows
 
     def __add__(self, other):
         self.add(other)
@@ -401,44 +956,119 @@ class MessagePanel(Panel):
         if isinstance(messages, str):
             messages = [messages]
         for message in messages:
-            self.msgs += message.split("\n")
+            self.msgs.extend(message.split("\n"))
 
     def clear(self):
-        self.msgs = []
+        self.msgs.clear()
 
     def get_current_messages(self):
-        return self.msgs[-self.rows:]
+        return list(islice(reversed(self.msgs), self.rows))[::-1]
+
+    def invalidate(self):
+        super(MessagePanel, self).invalidate()
+        self.drawn = [None] * self.rows
+
+    def damage(self, rect):
+        super(MessagePanel, self).damage(rect)
+        overlap = rect_intersection(rect, self.get_content_rect())
+        if overlap is not None:
+            for row in range(overlap[1] - self.y, overlap[1] - self.y + overlap[3]):
+                self.drawn[row] = None
+
+    def draw_line(self, line, row, libtcod, console):
+        for i in range(self.max_len):
+            if i < len(line):
+                libtcod.console_put_char(console, self.x + i, self.y + row, line[i])
+            else:
+                libtcod.console_put_char(console, self.x + i, self.y + row, self.default_char)
 
     def redraw(self, libtcod, console):
-        super(MessagePanel, self).redraw(libtcod, console)
+        rects = super(MessagePanel, self).redraw(libtcod, console)
         msgs_to_display = self.get_current_messages()
-        for j in range(len(msgs_to_display)):
-            msg = msgs_to_display[j]
-            # TODO: optimize this
-            # Clear msg board
-            for i in range(self.max_len):
-                libtcod.console_put_char(console, self.x + i, self.y + j, self.default_char)
-            # Print msg
-            for i in range(min(len(msg), self.max_len)):
-                libtcod.console_put_char(console, self.x + i, self.y + j, msg[i])
+        for j in range(self.rows):
+            if j < len(msgs_to_display):
+                line = msgs_to_display[j][:self.max_len]
+            else:
+                line = ""
+            # Outside of a Compositor the console may have been cleared, so every row is drawn.
+            if line != self.drawn[j] or not self.composited:
+                self.draw_line(line, j, libtcod, console)
+                self.drawn[j] = line
+                rects += [(self.x, self.y + j, self.max_len, 1)]
+        return rects
 
 
 class StatusPanel(MessagePanel):
     def __init__(self, x, y, w, h, default_char=DEFAULT_CHAR, border=PanelBorder(), padding=PanelPadding().create(*[1]*4)):
         super(StatusPanel, self).__init__(x, y, w, h, default_char, border, padding)
         self.info = {}
+        self.info_changed = False
 
     def __getitem__(self, item):
         return self.info[item]
 
     def __setitem__(self, key, value):
-        self.info[str(key)] = str(value)
+        key, value = str(key), str(value)
+        if self.info.get(key) != value:
+            self.info[key] = value
+            self.info_changed = True
 
     def __contains__(self, item):
         return item in self.info
 
     def get_current_messages(self):
-        self.msgs = []
-        for key in self.info:
-            self.msgs += [key + ": " + self.info[key]]
+        # The messages are only made again when the info has changed.
+        if self.info_changed:
+            self.msgs.clear()
+            for key in self.info:
+                self.msgs.append(key + ": " + self.info[key])
+            self.info_changed = False
         return super(StatusPanel, self).get_current_messages()
+
+
+class Compositor(object):
+    """
+    Draws a set of panels in order of their z (higher is on top). Every panel only draws what changed, and when part
+    of a panel is drawn the panels on top of that part are told to draw it again so that they stay on top.
+
+    Ex.
+    >>> compositor = Compositor()
+    >>> compositor.add(self.map)
+    >>> compositor.add(self.popup, z=1)  # Shown over the map
+    >>> compositor.redraw(libtcod, console)  # In draw_screen
+    """
+    def __init__(self):
+        self.layers = []
+
+    def add(self, panel, z=0):
+        """Add a panel. Panels with the same z are drawn in the order they were added."""
+        assert isinstance(panel, Panel)
+        self.layers += [(z, panel)]
+        # sort is stable so panels with the same z keep their order.
+        self.layers.sort(key=lambda layer: layer[0])
+        panel.composited = True
+        panel.invalidate()
+
+    def remove(self, panel):
+        """Remove a panel. The panels that were under it draw that part again on the next redraw."""
+        self.layers = [(z, layer) for z, layer in self.layers if layer is not panel]
+        panel.composited = False
+        for z, layer in self.layers:
+            layer.damage(panel.get_rect())
+
+    def __iter__(self):
+        return iter([panel for z, panel in self.layers])
+
+    def redraw(self, libtcod, console):
+        """Draw the changes of every panel from the bottom up.
+
+        Returns:
+            list: The (x, y, w, h) rectangles of the console that were drawn.
+        """
+        drawn = []
+        for z, panel in self.layers:
+            for rect in drawn:
+                if rect_intersection(rect, panel.get_rect()) is not None:
+                    panel.damage(rect)
+            drawn += panel.redraw(libtcod, console)
+        return drawn
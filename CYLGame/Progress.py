@@ -0,0 +1,134 @@
+from __future__ import print_function
+import os
+import sys
+import time
+import ujson
+
+
+class CompProgress(object):
+    """Keeps track of how far along a competition simulation is and sends progress events to sinks.
+
+    A sink is any object with an emit(event) method. The event is a dict with:
+        event: "start", "progress" or "done".
+        games_done, games_total: The number of games played and the number expected to be played.
+        games_per_sec: The average rate since the start.
+        elapsed, eta: Seconds since the start and the estimated seconds left (None until a game is done).
+        slowest: The bots with the longest average turn time, slowest first. Each is a dict with "bot", a number
+            given to each student in the order they are first seen in this run (see bot_id), the student's "name",
+            "avg_turn_wall_time", the wall time of their batches divided by their turns in seconds, and the number of
+            "turns" played. The wall time counts the whole turn, the game and drawing included, not only the bot.
+        time: When the event was made.
+
+    Events are shown to anyone with the competition's token, so they never hold student tokens.
+    """
+    def __init__(self, sinks=None, total=0, interval=5.0, slowest=5):
+        """
+        Args:
+            sinks (list): The sinks to send events to.
+            total (int): The number of games that are expected to be played.
+            interval (float): The least number of seconds between two progress events.
+            slowest (int): The number of slowest bots to put in each event.
+        """
+        self.sinks = sinks or []
+        self.total = total
+        self.interval = interval
+        self.slowest = slowest
+        self.done = 0
+        self.bots = {}
+        self.names = {}
+        self.ids = {}
+        self.start_time = None
+        self.last_emit = 0
+
+    def start(self, total=None):
+        if total is not None:
+            self.total = total
+        self.start_time = time.time()
+        self.emit("start")
+
+    def set_total(self, total):
+        self.total = total
+
+    def bot_id(self, student):
+        """Get the id that stands for a student's token in this run's events.
+
+        The ids are only counted up, so unlike a hash of the token they can't be turned back into a token.
+        """
+        if student not in self.ids:
+            self.ids[student] = len(self.ids) + 1
+        return self.ids[student]
+
+    def update(self, student, games, turns, wall_time, name=None):
+        """Record a finished batch of games of a student's bot and send a progress event if it is time to."""
+        self.bot_id(student)
+        if name is not None:
+            self.names[student] = name
+        self.done += games
+        bot_turns, bot_time = self.bots.get(student, (0, 0.0))
+        self.bots[student] = (bot_turns + turns, bot_time + wall_time)
+        if time.time() - self.last_emit >= self.interval:
+            self.emit("progress")
+
+    def finish(self):
+        self.emit("done")
+
+    def get_event(self, event="progress"):
+        now = time.time()
+        elapsed = now - self.start_time if self.start_time is not None else 0.0
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        eta = None
+        if rate > 0:
+            eta = max(self.total - self.done, 0) / rate
+        slowest = sorted([(bot_time / turns, student, turns) for student, (turns, bot_time) in self.bots.items()
+                          if turns], reverse=True)[:self.slowest]
+        return {"event": event, "games_done": self.done, "games_total": self.total, "games_per_sec": rate,
+                "elapsed": elapsed, "eta": eta, "time": now,
+                "slowest": [{"bot": self.bot_id(student), "name": self.names.get(student),
+                             "avg_turn_wall_time": turn_time, "turns": turns}
+                            for turn_time, student, turns in slowest]}
+
+    def emit(self, event="progress"):
+        self.last_emit = time.time()
+        event = self.get_event(event)
+        for sink in self.sinks:
+            sink.emit(event)
+
+
+class LogProgressSink(object):
+    """Prints a line for each progress event."""
+    def __init__(self, stream=sys.stdout):
+        self.stream = stream
+
+    def emit(self, event):
+        line = "[" + event["event"] + "] " + str(event["games_done"]) + "/" + str(event["games_total"]) + " games"
+        line += ", %.2f games/sec" % event["games_per_sec"]
+        if event["eta"] is not None:
+            line += ", ETA %ds" % event["eta"]
+        if event["slowest"]:
+            slowest = event["slowest"][0]
+            line += ", slowest bot " + (slowest["name"] or slowest["bot"]) + \
+                " at %.2fms/turn (wall time)" % (slowest["avg_turn_wall_time"] * 1000)
+        print(line, file=self.stream)
+
+
+class JSONFileProgressSink(object):
+    """Keeps the latest progress event in a JSON file."""
+    def __init__(self, path):
+        self.path = path
+
+    def emit(self, event):
+        # Write then move so that readers never see half a file.
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as fp:
+            ujson.dump(event, fp)
+        os.rename(tmp_path, self.path)
+
+
+class GameDBProgressSink(object):
+    """Keeps the latest progress event with the competition so the game server can show it at /comp_status."""
+    def __init__(self, gamedb, token):
+        self.gamedb = gamedb
+        self.token = token
+
+    def emit(self, event):
+        self.gamedb.set_comp_progress(self.token, event)
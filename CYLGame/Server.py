@@ -6,11 +6,15 @@ import ujson
 import flask
 import random
 import shutil
+import threading
+from collections import OrderedDict
 import flask_classful
 import flaskext.markdown as flask_markdown
 from Game import GameRunner
 from Game import GameLanguage
 from Database import GameDB
+from Database import CachedGameDB
+from Comp import code_hash
 
 
 def static_file(filename):
@@ -42,7 +46,17 @@ class GameServer(flask_classful.FlaskView):
     avg_game_count = None
     charset = None
     gamedb = None
+    replays = None
+    replays_lock = None
     route_base = '/'
+    # The number of replays kept in memory for sim_frames.
+    REPLAY_CACHE_SIZE = 16
+    # Each checkpoint of a replay holds a copy of the game, so the cached replays are also bounded by their total
+    # number of checkpoints. Replays of long games are thinned down to REPLAY_GAME_CHECKPOINTS.
+    REPLAY_CACHE_CHECKPOINTS = 256
+    REPLAY_GAME_CHECKPOINTS = 64
+    # The most frames sim_frames sends at once.
+    MAX_SIM_FRAMES = 1000
 
     @classmethod
     def __load_language(cls):
@@ -108,6 +122,15 @@ class GameServer(flask_classful.FlaskView):
             obj["comps"] += [comp_obj]
         return ujson.dumps(obj)
 
+    @flask_classful.route('/comp_status/<token>', methods=["GET"])
+    def comp_status(self, token):
+        if not self.gamedb.is_comp_token(token):
+            return flask.jsonify(error="Invalid Token")
+        progress = self.gamedb.get_comp_progress(token)
+        if progress is None:
+            return flask.jsonify(error="This competition has not been simulated")
+        return ujson.dumps(progress)
+
     @flask_classful.route('/sim_avg', methods=['POST'])
     def sim_avg(self):
         # TODO: create this to run the game 100 times returning the average score to the user.
@@ -137,6 +160,11 @@ class GameServer(flask_classful.FlaskView):
 
     @flask_classful.route('/sim', methods=['POST'])
     def sim(self):
+        """Send all of the frames of a game.
+
+        The page uses sim_frames now, but other clients still use this, so it keeps sending "screen", "seed" and a
+        dict of formatted variables per frame in "debug" instead of the compact form of run_for_playback.
+        """
         code = flask.request.get_json(silent=True).get('code', '')
         seed_str = flask.request.get_json(silent=True).get('seed', '')
         seed = random.randint(0, sys.maxint)
@@ -151,7 +179,10 @@ class GameServer(flask_classful.FlaskView):
             return flask.jsonify(error="Code did not compile")
         runner = GameRunner(self.game, prog)
         try:
-            result = ujson.dumps(runner.run_for_playback(seed=seed))
+            playback = runner.run_for_playback(seed=seed)
+            result = ujson.dumps({"screen": playback["screen"], "seed": playback["seed"],
+                                  "debug": [runner.get_debug_vars(playback, frame)
+                                            for frame in range(len(playback["debug"]))]})
         except Exception as e:
             print(e)
             return flask.jsonify(error="Your bot ran into an error at runtime.\n"
@@ -159,6 +190,57 @@ class GameServer(flask_classful.FlaskView):
                                        "Make sure to include your code.")
         return result
 
+    @flask_classful.route('/sim_frames', methods=['POST'])
+    def sim_frames(self):
+        """Send the frames start up to start + count of a game.
+
+        The game is played once without capturing any screens and kept as a replay so that later pages of the same
+        code and seed are made from its closest checkpoint.
+        """
+        data = flask.request.get_json(silent=True)
+        code = data.get('code', '')
+        seed_str = data.get('seed', '')
+        try:
+            start = int(data.get('start', 0))
+            count = min(int(data.get('count', 100)), self.MAX_SIM_FRAMES)
+        except:
+            return flask.jsonify(error="Invalid Frame Range")
+        seed = random.randint(0, sys.maxint)
+        if seed_str:
+            try:
+                seed = int(seed_str, 36)
+            except:
+                return flask.jsonify(error="Invalid Seed")
+
+        key = (code_hash(code), seed)
+        # Requests are served on threads, so the cache is only used under its lock. Replays are made outside of it.
+        with self.replays_lock:
+            runner, replay = self.replays.pop(key, (None, None))
+        if runner is None:
+            try:
+                prog = self.compiler.compile(code.split("\n"))
+            except:
+                return flask.jsonify(error="Code did not compile")
+            runner = GameRunner(self.game, prog)
+            replay = None
+        try:
+            if replay is None:
+                replay = runner.run_for_replay(seed=seed)
+                replay.thin(self.REPLAY_GAME_CHECKPOINTS)
+            result = ujson.dumps(runner.get_replay_frames(replay, start, start + count))
+        except Exception as e:
+            print(e)
+            return flask.jsonify(error="Your bot ran into an error at runtime.\n"
+                                       "If you think that your bot is correct, please file a bug report!\n"
+                                       "Make sure to include your code.")
+        with self.replays_lock:
+            self.replays[key] = (runner, replay)
+            while len(self.replays) > self.REPLAY_CACHE_SIZE or \
+                    sum([len(cached.checkpoints) for _, cached in self.replays.values()]) > \
+                    self.REPLAY_CACHE_CHECKPOINTS:
+                self.replays.popitem(last=False)
+        return result
+
     @flask_classful.route('/check_token', methods=['POST'])
     def check_token(self):
         token = flask.request.get_json(silent=True).get('token', '')
@@ -184,16 +266,30 @@ class GameServer(flask_classful.FlaskView):
                                 intro_text=intro)
 
     @classmethod
-    def serve(cls, game, host=None, port=None, compression=False, language=GameLanguage.LITTLEPY,
-              avg_game_count=10, game_data_path="temp_game"):
+    def create_app(cls, game, compression=False, language=GameLanguage.LITTLEPY, avg_game_count=10,
+                   game_data_path="temp_game", cache_size=0):
+        """Set up the game server and create its flask app without running it.
+
+        Call cleanup() when done with the app to remove the copied charset.
+
+        Args:
+            cache_size (int): If more than 0, keep up to this many names, scores and code files from the game
+                database in memory.
+
+        Returns:
+            flask.Flask: The app with all of the game server routes registered.
+        """
         cls.game = game
-        cls.host = host
-        cls.port = port
         cls.compression = compression
         cls.language = language
         cls.avg_game_count = avg_game_count
-        cls.gamedb = GameDB(game_data_path)
+        if cache_size > 0:
+            cls.gamedb = CachedGameDB(game_data_path, cache_size=cache_size)
+        else:
+            cls.gamedb = GameDB(game_data_path)
         cls.charset = cls.__copy_in_charset(game.CHAR_SET)
+        cls.replays = OrderedDict()
+        cls.replays_lock = threading.Lock()
 
         cls.app = flask.Flask(__name__.split('.')[0])
 
@@ -209,6 +305,20 @@ class GameServer(flask_classful.FlaskView):
             flask_compress.Compress(cls.app)
         cls.register(cls.app)
         cls.__load_language()
+        return cls.app
+
+    @classmethod
+    def cleanup(cls):
+        if os.path.exists(static_file(os.path.join("fonts", cls.charset))):
+            os.remove(static_file(os.path.join("fonts", cls.charset)))
+
+    @classmethod
+    def serve(cls, game, host=None, port=None, compression=False, language=GameLanguage.LITTLEPY,
+              avg_game_count=10, game_data_path="temp_game", cache_size=0):
+        cls.host = host
+        cls.port = port
+        cls.create_app(game, compression=compression, language=language, avg_game_count=avg_game_count,
+                       game_data_path=game_data_path, cache_size=cache_size)
         if cls.host and cls.port:
             cls.app.run(cls.host, cls.port)
         elif cls.port:
@@ -218,9 +328,8 @@ class GameServer(flask_classful.FlaskView):
         else:
             cls.app.run()
         print("Dying...")
-        if os.path.exists(static_file(os.path.join("fonts", cls.charset))):
-            print("Removing charset...")
-            os.remove(static_file(os.path.join("fonts", cls.charset)))
+        print("Removing charset...")
+        cls.cleanup()
         print("All good :)")
 
 
@@ -6,10 +6,13 @@ from .Game import run
 from .Panels import Map
 from .Panels import Panel
 from .Panels import MapPanel
+from .Panels import ArrayMap
+from .Panels import ArrayMapPanel
 from .Panels import MessagePanel
 from .Panels import StatusPanel
 from .Panels import PanelBorder
 from .Panels import PanelPadding
 from .Panels import ColoredChar
+from .Panels import Compositor
 
 __version__ = '0.2.0'
@@ -0,0 +1,88 @@
+#!/usr/bin/python
+"""Benchmark the per-turn overhead of handing variables to a bot and back.
+
+The bot used here only copies its variables (like littlepython does) so the times are the runner's own overhead.
+
+Ex.
+    python benchmarks/bot_turn_benchmark.py --vars 20 --turns 200000 -o bot_turn_bench.json
+"""
+from __future__ import print_function
+import time
+import ujson
+import random
+import argparse
+import timeit
+from CYLGame.Game import Game
+from CYLGame.Game import GameRunner
+
+
+class NullBot(object):
+    """Runs like an LPProg that doesn't do anything but set move."""
+    def run(self, static_vars={}):
+        state = dict(static_vars)
+        state["move"] = ord("w")
+        return state
+
+
+def rebuild_turn(runner, prev_vars, game_vars):
+    """How GameRunner used to run a bot turn: rebuild the variables every turn and pop the constants back out."""
+    vars = dict(prev_vars)
+    vars.update(runner.BOT_CONSTS)
+    vars.update(game_vars)
+    nxt_vars = runner.bot.run(vars)
+    for key in runner.BOT_CONSTS:
+        nxt_vars.pop(key)
+    return nxt_vars
+
+
+def bench(turn, start_vars, game_vars, turns):
+    vars = start_vars
+    start = timeit.default_timer()
+    for game_var in game_vars[:turns]:
+        vars = turn(vars, game_var)
+    seconds = timeit.default_timer() - start
+    return {"seconds": seconds, "usec_per_turn": seconds / turns * 1e6}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the per-turn overhead of running a bot.")
+    parser.add_argument("--vars", type=int, default=10, help="Number of variables the game gives the bot")
+    parser.add_argument("--changed", type=int, default=3, help="Number of those variables that change every turn")
+    parser.add_argument("--turns", type=int, default=100000, help="Number of timed turns")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the generated variables")
+    parser.add_argument("-o", "--output", type=str, default=None, help="Write the JSON report here")
+    args = parser.parse_args()
+
+    rand = random.Random(args.seed)
+    runner = GameRunner(Game, NullBot())
+    names = ["var" + str(i) for i in range(args.vars)]
+    fixed = dict((name, rand.randint(0, 100)) for name in names[args.changed:])
+    game_vars = []
+    for _ in range(args.turns):
+        turn_vars = dict(fixed)
+        turn_vars.update((name, rand.randint(0, 100)) for name in names[:args.changed])
+        game_vars += [turn_vars]
+
+    null_bot = bench(lambda vars, game_var: runner.bot.run(vars), dict(runner.BOT_CONSTS), game_vars, args.turns)
+    results = {
+        "bot only": null_bot,
+        "rebuild (old)": bench(lambda vars, game_var: rebuild_turn(runner, vars, game_var), {}, game_vars,
+                               args.turns),
+        "frame (GameRunner.run_bot)": bench(runner.run_bot, dict(runner.BOT_CONSTS), game_vars, args.turns),
+    }
+    for name in ["rebuild (old)", "frame (GameRunner.run_bot)"]:
+        results[name]["overhead_usec_per_turn"] = results[name]["usec_per_turn"] - null_bot["usec_per_turn"]
+
+    report = {"config": {"vars": args.vars, "changed": args.changed, "turns": args.turns, "seed": args.seed,
+                         "consts": len(runner.BOT_CONSTS)},
+              "timestamp": int(time.time()),
+              "results": results}
+    if args.output:
+        with open(args.output, "w") as fp:
+            ujson.dump(report, fp, indent=2, escape_forward_slashes=False)
+    else:
+        print(ujson.dumps(report, indent=2, escape_forward_slashes=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+#!/usr/bin/python
+"""Benchmark GameDB and the scoreboard endpoints against a synthetic deployment.
+
+Ex.
+    python benchmarks/gamedb_benchmark.py --schools 500 --tokens 100000 --comps 50 -o gamedb_bench.json
+"""
+from __future__ import print_function
+import os
+import sys
+import time
+import ujson
+import random
+import shutil
+import argparse
+import tempfile
+import timeit
+from CYLGame.Game import Game
+from CYLGame.Database import GameDB
+from CYLGame.Database import CachedGameDB
+
+
+class BenchGame(Game):
+    """The scoreboards never run a game, but the server needs one to start."""
+    GAME_TITLE = "GameDB Benchmark"
+
+
+def generate_db(path, schools, tokens, comps, schools_per_comp, scored, rand):
+    """Fill path with a synthetic GameDB.
+
+    Schools and competitions go through GameDB itself. User tokens are written straight into the same layout
+    GameDB uses since get_new_token rescans every existing token and would take hours for 100k of them.
+
+    Returns:
+        dict: The school tokens mapped to the list of their user tokens.
+    """
+    gamedb = GameDB(path)
+    school_tks = [gamedb.add_new_school(u"School " + unicode(i)) for i in range(schools)]
+    students = dict((school_tk, []) for school_tk in school_tks)
+
+    for i, n in enumerate(rand.sample(xrange(16 ** GameDB.TOKEN_LEN), tokens)):
+        token = "%0*X" % (GameDB.TOKEN_LEN, n)
+        school_tk = school_tks[i % schools]
+        open(os.path.join(gamedb.schools_dir, school_tk, "tokens", token), "w").close()
+        os.mkdir(os.path.join(gamedb.data_dir, token))
+        students[school_tk] += [token]
+        if rand.random() < scored:
+            gamedb.save_name(token, "Student " + token)
+            gamedb.save_code(token, "# name: Student " + token + "\nmove = north\n")
+            gamedb.save_avg_score(token, rand.randint(0, 10000) / 100.0)
+
+    for i in range(comps):
+        comp_tk = gamedb.add_new_competition(u"Competition " + unicode(i))
+        for school_tk in rand.sample(school_tks, min(schools_per_comp, schools)):
+            gamedb.add_school_to_comp(comp_tk, school_tk)
+            gamedb.set_comp_avg_score(comp_tk, school_tk, rand.randint(0, 10000) / 100.0)
+            gamedb.set_comp_school_code(comp_tk, school_tk, "move = north\n")
+    return students
+
+
+def percentile(sorted_samples, pct):
+    index = int(round(pct / 100.0 * (len(sorted_samples) - 1)))
+    return sorted_samples[index]
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {"count": len(samples),
+            "total": sum(samples),
+            "mean": sum(samples) / len(samples),
+            "min": samples[0],
+            "p50": percentile(samples, 50),
+            "p95": percentile(samples, 95),
+            "max": samples[-1]}
+
+
+def time_calls(func, args_list):
+    samples = []
+    for args in args_list:
+        start = timeit.default_timer()
+        func(*args)
+        samples += [timeit.default_timer() - start]
+    return summarize(samples)
+
+
+def bench_gamedb(gamedb, students, repeat, rand):
+    school_tks = list(students)
+    user_tks = [rand.choice(students[rand.choice(school_tks)]) for _ in range(repeat)]
+    comp_tks = gamedb.get_comp_tokens()
+    comp_pairs = []
+    for _ in range(repeat):
+        comp_tk = rand.choice(comp_tks)
+        comp_pairs += [(comp_tk, rand.choice(gamedb.get_schools_in_comp(comp_tk)))]
+    bad_tks = ["%0*X" % (GameDB.TOKEN_LEN, rand.randint(0, 16 ** GameDB.TOKEN_LEN - 1)) for _ in range(repeat)]
+
+    users = [(tk,) for tk in user_tks]
+    schools = [(rand.choice(school_tks),) for _ in range(repeat)]
+    comps = [(rand.choice(comp_tks),) for _ in range(repeat)]
+
+    return {
+        "is_user_token": time_calls(gamedb.is_user_token, users),
+        "is_user_token (invalid)": time_calls(gamedb.is_user_token, [(tk,) for tk in bad_tks]),
+        "is_school_token": time_calls(gamedb.is_school_token, schools),
+        "is_comp_token": time_calls(gamedb.is_comp_token, comps),
+        "get_school_for_token": time_calls(gamedb.get_school_for_token, users),
+        "get_comps_for_token": time_calls(gamedb.get_comps_for_token, users),
+        "get_tokens_for_school": time_calls(gamedb.get_tokens_for_school, schools),
+        "get_schools_in_comp": time_calls(gamedb.get_schools_in_comp, comps),
+        "get_name": time_calls(gamedb.get_name, users),
+        "get_code": time_calls(gamedb.get_code, users),
+        "get_avg_score": time_calls(gamedb.get_avg_score, users),
+        "get_comp_avg_score": time_calls(gamedb.get_comp_avg_score, comp_pairs),
+        "save_code": time_calls(gamedb.save_code, [(tk, "move = south\n") for tk in user_tks]),
+        "save_name": time_calls(gamedb.save_name, [(tk, "Renamed " + tk) for tk in user_tks]),
+        "save_avg_score": time_calls(gamedb.save_avg_score, [(tk, 42.0) for tk in user_tks]),
+    }
+
+
+def bench_endpoints(path, students, repeat, rand, cache_size=0):
+    from CYLGame.Server import GameServer
+
+    app = GameServer.create_app(BenchGame, game_data_path=path, cache_size=cache_size)
+    try:
+        client = app.test_client()
+        comp_schools = set()
+        for comp_tk in GameServer.gamedb.get_comp_tokens():
+            comp_schools.update(GameServer.gamedb.get_schools_in_comp(comp_tk))
+        comp_schools = list(comp_schools) or list(students)
+
+        def post(route, token):
+            resp = client.post(route, data=ujson.dumps({"token": token}), content_type="application/json")
+            assert resp.status_code == 200, route + " returned " + str(resp.status_code)
+
+        scoreboard_tks = [(rand.choice(students[rand.choice(list(students))]),) for _ in range(repeat)]
+        comp_tks = [(rand.choice(students[rand.choice(comp_schools)]),) for _ in range(repeat)]
+        results = {
+            "POST /scoreboard": time_calls(lambda tk: post("/scoreboard", tk), scoreboard_tks),
+            "POST /comp_scoreboards": time_calls(lambda tk: post("/comp_scoreboards", tk), comp_tks),
+        }
+        if cache_size > 0:
+            results["endpoint cache"] = GameServer.gamedb.cache_stats()
+        return results
+    finally:
+        GameServer.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark GameDB against a synthetic deployment.")
+    parser.add_argument("--schools", type=int, default=500, help="Number of schools to generate")
+    parser.add_argument("--tokens", type=int, default=100000, help="Number of user tokens to generate")
+    parser.add_argument("--comps", type=int, default=50, help="Number of competitions to generate")
+    parser.add_argument("--schools-per-comp", type=int, default=20, help="Number of schools in each competition")
+    parser.add_argument("--scored", type=float, default=0.5,
+                        help="Fraction of users that have saved code, a name and a score")
+    parser.add_argument("--repeat", type=int, default=50, help="Number of timed calls per GameDB method")
+    parser.add_argument("--endpoint-repeat", type=int, default=5, help="Number of timed requests per endpoint")
+    parser.add_argument("--no-endpoints", action="store_true", help="Skip the scoreboard endpoints")
+    parser.add_argument("--cache-size", type=int, default=0,
+                        help="Benchmark a CachedGameDB holding this many entries instead of a plain GameDB")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the generated data")
+    parser.add_argument("--dir", type=str, default=None,
+                        help="Generate the database here and keep it, instead of in a temp dir")
+    parser.add_argument("-o", "--output", type=str, default=None, help="Write the JSON report here")
+    args = parser.parse_args()
+
+    rand = random.Random(args.seed)
+    path = args.dir or tempfile.mkdtemp(prefix="gamedb_bench_")
+    try:
+        print("Generating database in", path, "...", file=sys.stderr)
+        start = timeit.default_timer()
+        students = generate_db(path, args.schools, args.tokens, args.comps, args.schools_per_comp, args.scored,
+                               rand)
+        generate_time = timeit.default_timer() - start
+
+        print("Timing GameDB methods...", file=sys.stderr)
+        if args.cache_size > 0:
+            gamedb = CachedGameDB(path, cache_size=args.cache_size)
+        else:
+            gamedb = GameDB(path)
+        results = bench_gamedb(gamedb, students, args.repeat, rand)
+        if args.cache_size > 0:
+            results["cache"] = gamedb.cache_stats()
+        if not args.no_endpoints:
+            print("Timing scoreboard endpoints...", file=sys.stderr)
+            results.update(bench_endpoints(path, students, args.endpoint_repeat, rand, args.cache_size))
+    finally:
+        if not args.dir:
+            shutil.rmtree(path)
+
+    report = {"config": {"schools": args.schools, "tokens": args.tokens, "comps": args.comps,
+                         "schools_per_comp": args.schools_per_comp, "scored": args.scored, "seed": args.seed,
+                         "cache_size": args.cache_size},
+              "timestamp": int(time.time()),
+              "generate_seconds": generate_time,
+              "results": results}
+    if args.output:
+        with open(args.output, "w") as fp:
+            ujson.dump(report, fp, indent=2, escape_forward_slashes=False)
+    else:
+        print(ujson.dumps(report, indent=2, escape_forward_slashes=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/python
+"""Benchmark GameRunner.run_for_scores against run_for_scores_lockstep for a game.
+
+The game's module has to be importable (e.g. run this from the game's directory).
+
+Ex.
+    python benchmarks/lockstep_benchmark.py apple_game:AppleFinder --games 100 --batch-size 10 -o lockstep_bench.json
+"""
+from __future__ import print_function
+import sys
+import time
+import ujson
+import argparse
+import importlib
+import timeit
+from CYLGame.Game import GameLanguage
+from CYLGame.Game import GameRunner
+
+
+def load_game(name):
+    module_name, class_name = name.split(":")
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def bench(run, seeds, batch_size):
+    """Run the seeds in batches of batch_size with run, like Comp.play_batch does.
+
+    Returns:
+        tuple: The scores and a dict of the timings.
+    """
+    scores = []
+    start = timeit.default_timer()
+    for i in range(0, len(seeds), batch_size):
+        scores += run(seeds[i:i + batch_size])
+    seconds = timeit.default_timer() - start
+    return scores, {"seconds": seconds, "games_per_sec": len(seeds) / seconds if seconds else None}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the lock-step runner against one game at a time.")
+    parser.add_argument("game", type=str, help="The game class as module:Class")
+    parser.add_argument("--code", type=str, default=None, help="The bot's code file. Defaults to the game's bot")
+    parser.add_argument("--games", type=int, default=100, help="Number of games to play with each runner")
+    parser.add_argument("--batch-size", type=int, default=10, help="Number of games the lock-step runner plays at once")
+    parser.add_argument("-o", "--output", type=str, default=None, help="Write the JSON report here")
+    args = parser.parse_args()
+
+    from littlepython import Compiler
+    game = load_game(args.game)
+    if args.code:
+        with open(args.code) as fp:
+            code = fp.read()
+    else:
+        code = game.default_prog_for_bot(GameLanguage.LITTLEPY)
+    prog = Compiler().compile(code.split("\n"))
+    seeds = range(1, args.games + 1)
+
+    results = {}
+    all_scores = {}
+    for name, run in [("one at a time", lambda seeds: runner.run_for_scores(seeds=seeds)),
+                      ("lockstep", lambda seeds: runner.run_for_scores_lockstep(seeds=seeds))]:
+        print("Timing", name, "...", file=sys.stderr)
+        runner = GameRunner(game, prog)
+        all_scores[name], results[name] = bench(run, seeds, args.batch_size)
+        results[name]["turns"] = runner.turn_count
+        results[name]["turns_per_sec"] = runner.turn_count / results[name]["seconds"]
+    assert all_scores["one at a time"] == all_scores["lockstep"], "The runners gave different scores"
+
+    report = {"config": {"game": args.game, "code": args.code, "games": args.games, "batch_size": args.batch_size},
+              "timestamp": int(time.time()),
+              "results": results,
+              "speedup": results["one at a time"]["seconds"] / results["lockstep"]["seconds"]}
+    if args.output:
+        with open(args.output, "w") as fp:
+            ujson.dump(report, fp, indent=2, escape_forward_slashes=False)
+    else:
+        print(ujson.dumps(report, indent=2, escape_forward_slashes=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+#!/usr/bin/python
+"""Benchmark Map against ArrayMap (and MapPanel against ArrayMapPanel) on a busy, mostly full map.
+
+Ex.
+    python benchmarks/map_benchmark.py --width 80 --height 40 --ops 200000 -o map_bench.json
+"""
+from __future__ import print_function
+import sys
+import time
+import ujson
+import random
+import argparse
+import timeit
+from CYLGame.Panels import Map
+from CYLGame.Panels import ArrayMap
+from CYLGame.Panels import MapPanel
+from CYLGame.Panels import ArrayMapPanel
+from CYLGame.Panels import ColoredChar
+
+CHARS = "#.@$%&*O"
+
+
+class NullLibtcod(object):
+    """Takes the same console calls as libtcod and drops them, so redraw times only count the panel's own work."""
+    BKGND_NONE = 0
+
+    def console_set_char(self, console, x, y, char):
+        pass
+
+    def console_set_char_foreground(self, console, x, y, color):
+        pass
+
+    def console_set_char_background(self, console, x, y, color):
+        pass
+
+    def console_put_char(self, console, x, y, char, flag=0):
+        pass
+
+    def console_put_char_ex(self, console, x, y, char, foreground, background):
+        pass
+
+    def console_fill_char(self, console, chars):
+        pass
+
+    def console_fill_foreground(self, console, r, g, b):
+        pass
+
+    def console_fill_background(self, console, r, g, b):
+        pass
+
+    def console_new(self, w, h):
+        return None
+
+    def console_blit(self, src, x, y, w, h, dst, dst_x, dst_y):
+        pass
+
+    def console_delete(self, console):
+        pass
+
+    def console_get_width(self, console):
+        return 0
+
+    def console_get_height(self, console):
+        return 0
+
+
+def make_ops(w, h, ops, rand):
+    positions = [(rand.randrange(w), rand.randrange(h)) for _ in range(ops)]
+    chars = [rand.choice(CHARS) for _ in range(ops)]
+    colored = [ColoredChar(rand.choice(CHARS), (rand.randrange(256), 0, 0)) for _ in range(ops)]
+    return positions, chars, colored
+
+
+def fill(m, w, h, fill_ratio, rand):
+    for x in range(w):
+        for y in range(h):
+            if rand.random() < fill_ratio:
+                m[(x, y)] = rand.choice(CHARS)
+
+
+def time_it(func):
+    start = timeit.default_timer()
+    func()
+    return timeit.default_timer() - start
+
+
+def bench_map(make_map, w, h, fill_ratio, ops, rand):
+    positions, chars, colored = ops
+    m = make_map()
+    fill(m, w, h, fill_ratio, rand)
+    m.get_diff()
+
+    def add():
+        for pos, char in zip(positions, chars):
+            m[pos] = char
+
+    def add_colored():
+        for pos, char in zip(positions, colored):
+            m[pos] = char
+
+    def get():
+        for pos in positions:
+            m[pos]
+
+    def get_all_pos():
+        for char in chars:
+            m.get_all_pos(char)
+
+    def rm_char():
+        for pos in positions:
+            m.rm_char(pos)
+
+    results = {}
+    for name, func in [("add", add), ("add (ColoredChar)", add_colored), ("get_char_at", get),
+                       ("get_all_pos", get_all_pos), ("rm_char", rm_char)]:
+        seconds = time_it(func)
+        results[name] = {"seconds": seconds, "ops_per_sec": len(positions) / seconds if seconds else None}
+    return results
+
+
+def bench_redraw(make_panel, w, h, fill_ratio, frames, changes, rand):
+    libtcod = NullLibtcod()
+    panel = make_panel()
+    fill(panel, panel.w, panel.h, fill_ratio, rand)
+    panel.redraw(libtcod, None)
+
+    updates = [[((rand.randrange(panel.w), rand.randrange(panel.h)), rand.choice(CHARS)) for _ in range(changes)]
+               for _ in range(frames)]
+
+    def redraw():
+        for frame in updates:
+            for pos, char in frame:
+                panel[pos] = char
+            panel.redraw(libtcod, None)
+
+    seconds = time_it(redraw)
+    return {"seconds": seconds, "frames_per_sec": frames / seconds if seconds else None}
+
+
+def bench_memory(make_map, w, h, fill_ratio, rand):
+    """Count the ColoredChar objects a filled map hands out and how big each one is."""
+    m = make_map()
+    fill(m, w, h, fill_ratio, rand)
+    cells = [m[(x, y)] for x in range(w) for y in range(h)]
+    sample = ColoredChar("#", (rand.randrange(256), 0, 0))
+    size = sys.getsizeof(sample)
+    if hasattr(sample, "__dict__"):
+        size += sys.getsizeof(sample.__dict__)
+    return {"cells": len(cells), "distinct_colored_chars": len(set(map(id, cells))), "colored_char_bytes": size}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Map against ArrayMap.")
+    parser.add_argument("--width", type=int, default=80, help="Width of the map")
+    parser.add_argument("--height", type=int, default=40, help="Height of the map")
+    parser.add_argument("--fill", type=float, default=0.8, help="Fraction of cells that are set before timing")
+    parser.add_argument("--ops", type=int, default=100000, help="Number of timed calls per method")
+    parser.add_argument("--frames", type=int, default=1000, help="Number of timed panel redraws")
+    parser.add_argument("--changes", type=int, default=50, help="Number of cells changed before each redraw")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the generated operations")
+    parser.add_argument("-o", "--output", type=str, default=None, help="Write the JSON report here")
+    args = parser.parse_args()
+
+    w, h = args.width, args.height
+    results = {}
+    memory = {}
+    for name, make_map, make_panel in [("Map", lambda: Map(), lambda: MapPanel(0, 0, w, h)),
+                                       ("ArrayMap", lambda: ArrayMap(w, h), lambda: ArrayMapPanel(0, 0, w, h))]:
+        print("Timing", name, "...", file=sys.stderr)
+        # Both classes get the same operations.
+        rand = random.Random(args.seed)
+        ops = make_ops(w, h, args.ops, rand)
+        results[name] = bench_map(make_map, w, h, args.fill, ops, rand)
+        results[name]["redraw"] = bench_redraw(make_panel, w, h, args.fill, args.frames, args.changes, rand)
+        memory[name] = bench_memory(make_map, w, h, args.fill, rand)
+
+    speedup = {}
+    for op in results["Map"]:
+        if results["ArrayMap"][op]["seconds"]:
+            speedup[op] = results["Map"][op]["seconds"] / results["ArrayMap"][op]["seconds"]
+
+    report = {"config": {"width": w, "height": h, "fill": args.fill, "ops": args.ops, "frames": args.frames,
+                         "changes": args.changes, "seed": args.seed},
+              "timestamp": int(time.time()),
+              "results": results,
+              "memory": memory,
+              "speedup": speedup}
+    if args.output:
+        with open(args.output, "w") as fp:
+            ujson.dump(report, fp, indent=2, escape_forward_slashes=False)
+    else:
+        print(ujson.dumps(report, indent=2, escape_forward_slashes=False))
+
+
+if __name__ == '__main__':
+    main()
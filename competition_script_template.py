@@ -1,17 +1,59 @@
 #!/usr/bin/python
-import sys
+import argparse
 from apple_game import AppleFinder
 from littlepython import Compiler
 from CYLGame.Database import GameDB
 from CYLGame.Comp import sim_competition
+from CYLGame.Comp import race_competition
+from CYLGame.Distributed import Coordinator
+from CYLGame.Progress import CompProgress
+from CYLGame.Progress import LogProgressSink
+from CYLGame.Progress import GameDBProgressSink
+from CYLGame.Progress import JSONFileProgressSink
 
 
-assert len(sys.argv) >= 2
+parser = argparse.ArgumentParser(description="Simulate a competition.")
+parser.add_argument("comp_token", type=str, help="The competition's token")
+parser.add_argument("dbfile", type=str, help="The root path of the game database")
+parser.add_argument("processes", nargs="?", type=int, default=None, help="The number of processes to play games in")
+parser.add_argument("--coordinator", nargs="?", type=int, default=None, metavar="PORT",
+                    help="Have workers on other machines play the games. "
+                         "Start them with: python apple_game.py worker --host HOST --port PORT --authkey AUTHKEY")
+parser.add_argument("--host", nargs="?", type=str, default="127.0.0.1",
+                    help="The address the coordinator listens on. Use this machine's address for remote workers")
+parser.add_argument("--racing", action="store_true",
+                    help="Drop students that are clearly not their school's best early instead of playing every run")
+parser.add_argument("--progress-file", nargs="?", type=str, default=None,
+                    help="Keep the latest progress in this JSON file")
+parser.add_argument("--authkey", nargs="?", type=str, default=None,
+                    help="The authkey workers must use. Defaults to a new random key, which is printed")
+args = parser.parse_args()
 
-comp_token = sys.argv[1]
+comp_token = args.comp_token
 game = AppleFinder
 compiler = Compiler()
-gamedb = GameDB(sys.argv[2])
+gamedb = GameDB(args.dbfile)
 assert gamedb.is_comp_token(comp_token)
 
-sim_competition(compiler=compiler, game=game, gamedb=gamedb, token=comp_token, runs=100, debug=True)
\ No newline at end of file
+# The game server shows the progress at /comp_status/<comp_token>
+sinks = [LogProgressSink(), GameDBProgressSink(gamedb, comp_token)]
+if args.progress_file:
+    sinks += [JSONFileProgressSink(args.progress_file)]
+progress = CompProgress(sinks)
+
+coordinator = None
+if args.coordinator is not None:
+    coordinator = Coordinator((args.host, args.coordinator), authkey=args.authkey)
+    coordinator.start()
+    print("Coordinator listening on " + args.host + ":" + str(coordinator.address[1]) + " with authkey " +
+          coordinator.authkey)
+
+if args.racing:
+    race_competition(compiler=compiler, game=game, gamedb=gamedb, token=comp_token, runs=100, debug=True,
+                     processes=args.processes, coordinator=coordinator, progress=progress)
+else:
+    sim_competition(compiler=compiler, game=game, gamedb=gamedb, token=comp_token, runs=100, debug=True,
+                    processes=args.processes, coordinator=coordinator, progress=progress)
+
+if coordinator is not None:
+    coordinator.shutdown()
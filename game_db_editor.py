@@ -3,6 +3,8 @@ from __future__ import print_function
 import os
 import sys
 from CYLGame.Database import GameDB
+from CYLGame.Comp import rank_competition
+from CYLGame.Comp import write_comp_report
 
 gamedb = None
 cur_school = None
@@ -102,6 +104,35 @@ def list_schools_in_comp():
     pause()
 
 
+def show_comp_ranking():
+    global gamedb, cur_comp
+    clear()
+    print("Ranking")
+    for place, entry in enumerate(rank_competition(gamedb, cur_comp), 1):
+        line = str(place) + ". " + gamedb.get_name(entry["school"]) + ": " + str(entry["score"])
+        line += " (" + str(entry["games"]) + " games)"
+        if entry["lead"] is not None:
+            line += " leads next by " + str(round(entry["lead"], 2))
+            if entry["stderr"] is not None:
+                line += " +/- " + str(round(entry["stderr"], 2))
+            if not entry["confident"]:
+                line += " (NOT confident, consider more runs)"
+        print(line)
+    pause()
+
+
+def export_comp_report():
+    global gamedb, cur_comp
+    clear()
+    fmt = get_input("Enter report format (csv or json): ", lambda x: x in ("csv", "json"), "Invalid Format. Try Again.")
+    path = get_input("Enter path for the report file: ", lambda x: not os.path.exists(x),
+                     "That file already exists. Try Again.")
+    with open(path, "wb" if fmt == "csv" else "w") as fp:
+        write_comp_report(gamedb, cur_comp, fp, fmt)
+    print("Report saved to", path)
+    pause()
+
+
 # TODO(derpferd): add function to remove a school
 
 
@@ -148,14 +179,53 @@ def list_tokens():
     pause()
 
 
+def export_snapshot():
+    global gamedb
+    clear()
+    path = get_input("Enter path for the snapshot file: ", lambda x: not os.path.exists(x),
+                     "That file already exists. Try Again.")
+    print("Exporting...")
+    gamedb.export_snapshot(path)
+    print("Snapshot saved to", path)
+    pause()
+
+
+def verify_snapshot():
+    clear()
+    path = get_input("Enter path of the snapshot file: ", lambda x: os.path.isfile(x), "Invalid File. Try Again.")
+    try:
+        dir_count, file_count = GameDB.verify_snapshot(path)
+        print("Snapshot is good. It has", dir_count, "directories and", file_count, "files.")
+    except ValueError as e:
+        print("Snapshot is BAD:", e)
+    pause()
+
+
+def import_snapshot():
+    global gamedb
+    clear()
+    path = get_input("Enter path of the snapshot file: ", lambda x: os.path.isfile(x), "Invalid File. Try Again.")
+    if get_input("This will replace EVERYTHING in the current game dir. Type 'yes' to continue: ") != "yes":
+        return
+    clear_selection()
+    try:
+        gamedb.import_snapshot(path)
+        print("Snapshot imported.")
+    except ValueError as e:
+        print("Snapshot is BAD so nothing was changed:", e)
+    pause()
+
+
 def get_main_menu_options():
     global cur_school
-    options = ["Add New School", "Select School", "Add New Competition", "Select Competition"]
+    options = ["Add New School", "Select School", "Add New Competition", "Select Competition", "Export Snapshot",
+               "Import Snapshot", "Verify Snapshot"]
     if cur_school is not None:
         options += ["Get new Tokens", "List current Tokens"]
     if cur_comp is not None:
         # TODO(derpferd): implement
-        options += ["Add School to Competition", "List Schools in Competition"]
+        options += ["Add School to Competition", "List Schools in Competition", "Show Competition Ranking",
+                    "Export Competition Report"]
     return options + ["Quit"]
 
 
@@ -195,12 +265,22 @@ def main():
             add_school_to_comp()
         elif option == "List Schools in Competition":
             list_schools_in_comp()
+        elif option == "Show Competition Ranking":
+            show_comp_ranking()
+        elif option == "Export Competition Report":
+            export_comp_report()
         elif option == "Add New School":
             add_school()
         elif option == "Get new Tokens":
             get_new_tokens()
         elif option == "List current Tokens":
             list_tokens()
+        elif option == "Export Snapshot":
+            export_snapshot()
+        elif option == "Import Snapshot":
+            import_snapshot()
+        elif option == "Verify Snapshot":
+            verify_snapshot()
 
 
 if __name__ == '__main__':